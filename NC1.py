@@ -1,11 +1,34 @@
 # Import packages
-from psychopy import core, event, gui, visual, parallel, prefs
+import argparse
 import time
-import math
 import random
-import csv
 import os
-ports_live = None # Set to None if parallel ports not plugged for coding/debugging other parts of exp
+import collections
+import statistics
+
+from allocator import SessionAllocator
+from data import BinaryWriter, DataWriter
+from inputs import InputDispatcher
+from schedule import assign_group, compile_schedule, make_block_order
+from timing import CriticalSection, FrameTimer, RealClock, ResponseTimer, make_countdown_frames
+from triggers import SimulatedPort, TriggerPort
+
+# command line options, e.g. python NC1.py --headless --pid 7
+parser = argparse.ArgumentParser()
+parser.add_argument("--headless", action="store_true", help="no window, virtual clock and scripted participant responses")
+parser.add_argument("--pid", help="participant ID (skips the prompts)")
+parser.add_argument("--seed", type=int, help="random seed for the block order and scripted responses")
+parser.add_argument("--data-folder", help="folder to save data in (default: data/ next to this script)")
+parser.add_argument("--setup-only", action="store_true", help="open the window and stimuli but do not run the session (used by benchmark.py)")
+parser.add_argument("--database", help="also save every finished trial to this SQLite database (lab-wide store)")
+parser.add_argument("--monitor", help="serve live session status as JSON on [HOST:]PORT (see monitor.py)")
+parser.add_argument("--registry", help="shared session registry to allocate PID, group, cb and block order from (multi-booth testing)")
+args = parser.parse_args()
+
+if args.seed is not None:
+    random.seed(args.seed)
+
+ports_live = None # Set to None if parallel ports not plugged for coding/debugging other parts of exp (headless runs always simulate them)
 
 ### Experiment details/parameters
 ## equipment parameters
@@ -13,6 +36,17 @@ port_buffer_duration = 1 #needs about 0.5s buffer for port signal to reset
 pain_response_duration = float("inf")
 response_hold_duration = 1 # How long the rating screen is left on the response (only used for Pain ratings)
 RENS_pulse_int = 0.1 # interval length for RENS on/off signals (e.g. 0.1 = 0.2s per pulse)
+poll_interval = 0.002 # sleep between input polls while waiting, well within one frame
+data_fsync = True # fsync the data file after every trial so a crash loses at most the trial in progress
+record_frame_timing = False # Set to True to save inter-flip intervals per trial phase to <PID>_frametimes.csv
+record_trajectories = False # Set to True to save per-frame slider and mouse positions to <PID>_trajectories.bin (needs NumPy)
+profile_session = False # Set to True to save cProfile stats and per-section CPU, wall and GC times to <PID>_profile.prof/.csv
+critical_sections = False # Set to True to hold off garbage collection from the countdown to the end of the heat window (compare <PID>_frametimes.csv with it on and off)
+critical_cpu = None # with critical_sections, pin the process to this CPU core during the window (Linux)
+critical_nice = None # with critical_sections, raise priority to this nice value during the window, e.g. -10 (Linux, needs root)
+composite_static_layers = False # Set to True to draw the fixed parts of the expectancy screen from one cached image (helps on integrated graphics)
+if args.setup_only:
+    data_fsync = False # benchmark.py times the trial code, not the disk
 
 # parallel port triggers
 port_address = 0x4fb8
@@ -27,6 +61,7 @@ P_info = {"PID": "",
 info_order = ["PID"]
 
 # iti_range = [6,8]
+countdown_phases = [("countdown", 3), ("expectancy", 3), ("heat", 4)] # seconds of digits only, expectancy prompt, then RENS/heat
 iti = 6
 familiarisation_iti = 3
 
@@ -36,6 +71,16 @@ text_height = 30
 textStim_arguments = {'height':30,
                       'color': "white",
                       'wrapWidth': 960}
+continue_text_arguments = {'pos': (0,-400), **textStim_arguments}
+exit_text_arguments = {'height': text_height,
+                       'color': "white",
+                       'pos': (0,0)}
+familiarisation_text_arguments = {'height': 35,
+                                  'pos': (0,0),
+                                  'wrapWidth': 800}
+choice_text_arguments = {'height': 35,
+                         'pos': (0,0)}
+continue_text = "\n\nPress spacebar to continue"
 
 RENS_image_size = (400,300)
 RENS_image_pos = (0,200)
@@ -45,24 +90,34 @@ RENS_text_pos = (0,300)
 # iti_jitter = [x * 1000 for x in iti_range]
 
 # Participant info input
+allocator = SessionAllocator(args.registry) if args.registry else None
+
 while True:
     try:
-        P_info["PID"] = input("Enter participant ID: ")
+        if allocator:
+            allocation = allocator.allocate()
+            P_info["PID"] = str(allocation["PID"])
+            print(f"Allocated participant ID {P_info['PID']}")
+        else:
+            P_info["PID"] = args.pid or input("Enter participant ID: ")
         if not P_info["PID"]:
             print("Participant ID cannot be empty.")
             continue
         
-        P_info["SONA"] = input("Enter SONA pool ID: ")
+        P_info["SONA"] = "" if args.pid else input("Enter SONA pool ID: ")
 
         
-        block_order = [1, 2, 3, 4]
-        random.shuffle(block_order)
+        block_order = allocation["block_order"] if allocator else make_block_order()
             
         data_filename = P_info["PID"] + "_responses.csv"
+        frametimes_filename = P_info["PID"] + "_frametimes.csv"
+        trajectories_filename = P_info["PID"] + "_trajectories"
+        profile_filename = P_info["PID"] + "_profile"
+        triggers_filename = P_info["PID"] + "_triggers.csv"
         script_directory = os.path.dirname(os.path.abspath(__file__))  #Set the working directory to the folder the Python code is opened from
         
         #set a path to a "data" folder to save data in
-        data_folder = os.path.join(script_directory, "data")
+        data_folder = args.data_folder or os.path.join(script_directory, "data")
 
         #set stimuli folder path
         stimulus_folder =  os.path.join(script_directory, "stimuli")
@@ -74,42 +129,21 @@ while True:
             
         #set file name within "data" folder
         data_filepath = os.path.join(data_folder,data_filename)
+        frametimes_filepath = os.path.join(data_folder,frametimes_filename)
+        trajectories_filepath = os.path.join(data_folder,trajectories_filename)
+        profile_filepath = os.path.join(data_folder,profile_filename)
+        triggers_filepath = os.path.join(data_folder,triggers_filename)
         
         if os.path.exists(data_filepath):
             print(f"Data for participant {P_info['PID']} already exists. Choose a different participant ID.") ### to avoid re-writing existing data
+            if allocator:
+                allocator.finish(P_info["PID"], "skipped")
+            elif args.pid:
+                raise SystemExit(1)
         
         
-        # Group == 1 == high OD
-        # Group == 2 == low OD
-        # Group == 3 == NH
-        # cb == 1 == RENS = GREEN, control = BLUE
-        # cb == 2 == RENS = BLUE, control = GREEN
-            
         else:
-            if int(P_info["PID"]) % 6 == 1:
-                group = 1
-                cb = 1 
-                groupname = "highOD"
-            elif int(P_info["PID"]) % 6 == 2:
-                group = 2
-                cb = 1 
-                groupname = "lowOD"
-            elif int(P_info["PID"]) % 6 == 3:
-                group = 3
-                cb = 1 
-                groupname = "naturalhistory"
-            elif int(P_info["PID"]) % 6 == 4:
-                group = 1
-                cb = 2 
-                groupname = "highOD"
-            elif int(P_info["PID"]) % 6 == 5:
-                group = 2
-                cb = 2 
-                groupname = "lowOD"
-            elif int(P_info["PID"]) % 6 == 0:
-                group = 3
-                cb = 2
-                groupname = "naturalhistory"
+            group, cb, groupname = assign_group(P_info["PID"])
             
             break  # Exit the loop if the participant ID is valid
         
@@ -120,238 +154,22 @@ while True:
 # get date and time of experiment start
 datetime = time.strftime("%Y-%m-%d_%H.%M.%S")
 
-if ports_live == True:
-    pport = parallel.ParallelPort(address=port_address) #Get from device Manager
-    pport.setData(0)
-    
-elif ports_live == None:
-    pport = None #Get from device Manager
-
-# set up screen
-exp_win = visual.Window(
-    size=(1920, 1080), fullscr=True, screen=0,
-    allowGUI=False, allowStencil=False,
-    monitor="testMonitor", color=[0, 0, 0], colorSpace="rgb1",
-    blendMode="avg", useFBO=True,
-    units="pix")
-
-# fixation stimulus
-fix_stim = visual.TextStim(exp_win,
-                            text = "x",
-                            color = "white",
-                            height = 50,
-                            font = "Roboto Mono Medium")
-
-
-RENS_image = visual.ImageStim(exp_win,
-                                    image=os.path.join(stimulus_folder, "constant.png"),
-                                    size = RENS_image_size,
-                                    pos = RENS_image_pos
-                                    )
-
-RENS_text = visual.TextStim(exp_win,
-                    text = "You are receiving monopolar TENS",
-                    height = 35,
-                    color = "white",
-                    pos = RENS_text_pos,
-                    wrapWidth= 960
-                    )
-
-
-#define waiting function so experiment doesn't freeze as it does with wait()
-def wait(time):
-    countdown_timer = core.CountdownTimer(time)
-    while countdown_timer.getTime() > 0:
-        termination_check()
-
-#create instruction trials
-def instruction_trial(instructions, holdtime=0, key="space"):
-    visual.TextStim(exp_win, text = instructions, **textStim_arguments).draw()
-    exp_win.flip()
-    wait(holdtime)
-    visual.TextStim(exp_win, text = instructions, **textStim_arguments).draw()
-    if key == "space":
-        visual.TextStim(exp_win,
-                        text = "\n\nPress spacebar to continue",
-                        pos = (0,-400),
-                        **textStim_arguments).draw()
-    exp_win.flip()
-
-    if key != None:
-        while True:
-            termination_check()
-            keys_pressed = event.getKeys(keyList=[key])
-            if key in keys_pressed:
-                exp_win.flip()
-                break
-            
-    wait(2)
-
-# Create functions
-    # Save responses to a CSV file
-def save_data(data):
-    for trial in trial_order:
-        trial['datetime'] = datetime
-        trial['experimentcode'] = experimentcode
-        trial["PID"] = P_info["PID"]
-        trial["SONA"] = P_info["SONA"]
-        trial["group"] = group
-        trial["groupname"] = groupname
-        trial["cb"] = cb
-        trial['blockorder'] = block_order
-
-    # Extract column names from the keys in the first trial dictionary
-    colnames = list(trial_order[0].keys())
-
-    # Open the CSV file for writing
-    with open(data_filepath, mode="w", newline="") as csv_file:
-        writer = csv.DictWriter(csv_file, fieldnames=colnames)
-        
-        # Write the header row
-        writer.writeheader()
-        
-        # Write each trial"s data to the CSV file
-        for trial in data:
-            writer.writerow(trial)
-    
-def exit_screen(instructions):
-    exp_win.flip()
-    visual.TextStim(exp_win,
-            text = instructions,
-            height = text_height,
-            color = "white",
-            pos = (0,0)).draw()
-    exp_win.flip()
-    event.waitKeys()
-    exp_win.close()
-    
-def termination_check(): #insert throughout experiment so participants can end at any point.
-    keys_pressed = event.getKeys(keyList=["escape"])  # Check for "escape" key during countdown
-    if "escape" in keys_pressed:
-        if ports_live:
-            pport.setData(0) # Set all pins to 0 to shut off context, RENS, shock etc.
-        # Save participant information
-
-        save_data(trial_order)
-        exit_screen(instructions_text["termination"])
-        core.quit()
-
-
-# Define trials
-trial_order = []
-
-# familiarisation trials
-num_familiarisation = 10
-
-for i in range(1, num_familiarisation + 1):
-    trial = {
-        "phase": "familiarisation",
-        "blocknum": None,
-        "blockname":None,
-        "stimulus": None,
-        "outcome": None,
-        "exp_response": None,
-        "pain_response": None,
-        "iti" : None
-    } 
-    trial_order.append(trial)
-
-#### 4 x blocks (4x fixed 12x outcomes with high/low OD)
-num_blocks_conditioning = 4
-num_blocks_extinction = 4
-
-conditioning_outcome_blocks = {
-    "highOD": [
-            ["low4", "high", "low3", "low5", "low3", "low5", "high", "low4", "high", "low5", "low4", "low3"],
-            ["low5", "low3", "low4", "high", "high", "low3", "low5", "low4", "low3", "high", "low4", "low5"],
-            ["low4", "low3", "low5", "high", "low5", "high", "low3", "low4", "low3", "high", "low4", "low5"],
-            ["low5", "low4", "high", "low3", "low3", "low5", "high", "low4", "high", "low3", "low4", "low5"]
-        ],
-    "lowOD": [
-            ["high", "high", "low4", "high", "high", "low3", "high", "high", "low5", "high", "high", "high"],
-            ["high", "high", "low5", "high", "low4", "high", "high", "high", "low3", "high", "high", "high"],
-            ["low3", "high", "high", "high", "high", "low5", "high", "high", "high", "low4", "high", "high"],
-            ["high", "high", "low5", "high", "high", "low3", "high", "high", "low4", "high", "high", "high"]
-        ],
-    "naturalhistory": []
-    }
-
-#low heat for every trial in extinction regardless of stimulus
-extinction_outcome_block = ['med']*12
-
-#blockname
-blockname = []
+# session-level fields added to every saved row
+session_info = {
+    "datetime": datetime,
+    "experimentcode": experimentcode,
+    "PID": P_info["PID"],
+    "SONA": P_info["SONA"],
+    "group": group,
+    "groupname": groupname,
+    "cb": cb,
+    "blockorder": block_order
+}
 
-# Populate naturalhistory by alternating between highOD and lowOD by block number
-# cb == 1 starts with highOD, cb == 2 starts with lowOD
-for block in range(1, num_blocks_conditioning + 1):
-    block_idx = block_order[block - 1]
-    if groupname == "naturalhistory":
-        if (block + cb) % 2 == 0:  # cb=1: blocks 1,3 are highOD; cb=2: blocks 1,3 are lowOD
-            conditioning_outcome_blocks["naturalhistory"].append(conditioning_outcome_blocks["highOD"][block_idx - 1])
-            blockname.append(f"highOD_{block_idx}")
-        else:
-            conditioning_outcome_blocks["naturalhistory"].append(conditioning_outcome_blocks["lowOD"][block_idx - 1])
-            blockname.append(f"lowOD_{block_idx}")
-    else:
-        blockname.append(f"{groupname}_{block_idx}")
-
-# calibration trials
-num_calibration = 4
-calibration_outcome_block = ['med'] * num_calibration
-
-for i in range(1, num_calibration + 1):
-    trial = {
-        "phase": "calibration",
-        "blocknum": None,
-        "blockname": None,
-        "stimulus": None,
-        "outcome": calibration_outcome_block[i - 1],
-        "exp_response": None,
-        "pain_response": None,
-        "iti": None
-    }
-    trial_order.append(trial)
-
-
-### create list of trials based on trial_block order, iterating through stimulus + outcome blocks in parallel
-for block in range(1, num_blocks_conditioning + 1):
-    # Create trials for each outcome in this block
-    for outcome in conditioning_outcome_blocks[groupname][block_order[block - 1] - 1]:
-        trial = {
-            "phase": "conditioning",
-            "blocknum": block,
-            "blockname": blockname[block - 1],
-            "stimulus": None,
-            "outcome": outcome,
-            "exp_response": None,
-            "pain_response": None,
-            "iti": None
-        }
-        trial_order.append(trial)         
-                    
-#create extinction trials, all outcomes same regardless of condition (low heat)
-for block in range(num_blocks_conditioning + 1, num_blocks_conditioning + num_blocks_extinction + 1):
-    # All extinction trials use medium heat regardless of group
-    for outcome in extinction_outcome_block:
-        trial = {
-            "phase": "extinction",
-            "blocknum": block,
-            "blockname":None,
-            "stimulus": None,
-            "outcome": outcome,
-            "exp_response": None,
-            "pain_response": None,
-            "iti": None
-        }
-        trial_order.append(trial)
-
-
-# # Assign trial numbers
-for trialnum, trial in enumerate(trial_order, start=1):
-    trial["trialnum"] = trialnum
-    
-save_data(trial_order)
+# Define trials (compiled and checked against the design, see schedule.py)
+schedule = compile_schedule(groupname, cb, block_order)
+trial_order = schedule.trials
+blockname = schedule.blocknames
     
 # # text stimuli
 instructions_text = {
@@ -403,6 +221,134 @@ response_instructions = {
     "choice": "Please choose whether you want to receive RENS on this trial."
     }
 
+### Start the session: PsychoPy, the window and the stimuli are only loaded from here on
+startup_times = {}
+startup_timer = time.perf_counter()
+
+if args.headless:
+    import headless
+    from headless import core, event, keyboard, visual
+    clock = headless.clock
+    headless.participant.random.seed(args.seed)
+else:
+    from psychopy import core, event, visual, parallel
+    from psychopy.hardware import keyboard
+    clock = RealClock(poll_interval)
+startup_times["psychopy"] = time.perf_counter() - startup_timer
+
+if ports_live == True and not args.headless:
+    pport = TriggerPort(parallel.ParallelPort(address=port_address), clock) #Get from device Manager
+    
+elif ports_live == None or args.headless:
+    pport = TriggerPort(SimulatedPort(), clock)
+
+pport.set(0)
+
+# set up screen
+exp_win = visual.Window(
+    size=(1920, 1080), fullscr=True, screen=0,
+    allowGUI=False, allowStencil=False,
+    monitor="testMonitor", color=[0, 0, 0], colorSpace="rgb1",
+    blendMode="avg", useFBO=True,
+    units="pix")
+
+startup_times["window"] = time.perf_counter() - startup_timer - startup_times["psychopy"]
+
+# measure the refresh rate once, the trial countdown is counted in frames
+frame_rate = exp_win.getActualFrameRate()
+if not frame_rate:
+    print("Could not measure the refresh rate, assuming 60 Hz")
+    frame_rate = 60
+countdown_frames = make_countdown_frames(frame_rate, countdown_phases)
+
+if record_frame_timing:
+    frame_timer = FrameTimer(1 / frame_rate)
+else:
+    frame_timer = None
+
+# all keyboard and mouse input goes through here, escape is checked by termination_check()
+# keys are read with psychopy.hardware.keyboard, which (PTB backend) timestamps each press at the device;
+# on core.monotonicClock those times are on the same timebase as clock.getTime()
+inputs = InputDispatcher(keyboard.Keyboard(clock = core.monotonicClock), event.Mouse(), clock)
+inputs.on_key("escape", inputs.abort)
+if args.headless:
+    headless.participant.keys = inputs.awaiting # the scripted participant presses whatever a screen waits for
+
+# flip the window, pair any new trigger edges with the flip, record the frame interval if frame timing is on
+# and read input once for the new frame (after the flip time is taken, so input handling never shifts it)
+def flip():
+    exp_win.flip()
+    flip_time = clock.getTime()
+    pport.flipped(flip_time)
+    if frame_timer:
+        frame_timer.record(flip_time)
+    inputs.poll()
+    return flip_time
+
+# mouse response times come from PsychoPy's press timestamps (see timing.ResponseTimer)
+response_timer = ResponseTimer(clock, inputs.mouse)
+
+if record_trajectories:
+    from trajectory import TrajectoryRecorder
+
+# sample the slider marker and the mouse for this frame if trajectory recording is on
+def record_slider(phase, slider):
+    if trajectory_recorder:
+        mouse_x, mouse_y = inputs.mouse.getPos()
+        trajectory_recorder.sample(phase, clock.getTime(), slider.markerPos, mouse_x, mouse_y, inputs.mouse.getPressed()[0])
+
+# TextStims keyed by text + style so each string is only laid out once
+# preloaded texts are kept for the session, other strings are evicted least recently used first
+class TextStimCache:
+    def __init__(self, win, max_dynamic=32):
+        self.win = win
+        self.preloaded = {}
+        self.dynamic = collections.OrderedDict()
+        self.max_dynamic = max_dynamic
+
+    def key(self, text, style):
+        return (text, tuple(sorted(style.items())))
+
+    def preload(self, text, **style):
+        self.preloaded[self.key(text, style)] = visual.TextStim(self.win, text = text, **style)
+
+    def get(self, text, **style):
+        key = self.key(text, style)
+        if key in self.preloaded:
+            return self.preloaded[key]
+        if key in self.dynamic:
+            self.dynamic.move_to_end(key)
+            return self.dynamic[key]
+        stim = self.dynamic[key] = visual.TextStim(self.win, text = text, **style)
+        if len(self.dynamic) > self.max_dynamic:
+            self.dynamic.popitem(last=False)
+        return stim
+
+text_stims = TextStimCache(exp_win)
+
+# fixation stimulus
+fix_stim = visual.TextStim(exp_win,
+                            text = "x",
+                            color = "white",
+                            height = 50,
+                            font = "Roboto Mono Medium")
+
+
+RENS_image = visual.ImageStim(exp_win,
+                                    image=os.path.join(stimulus_folder, "constant.png"),
+                                    size = RENS_image_size,
+                                    pos = RENS_image_pos
+                                    )
+
+RENS_text = visual.TextStim(exp_win,
+                    text = "You are receiving monopolar TENS",
+                    height = 35,
+                    color = "white",
+                    pos = RENS_text_pos,
+                    wrapWidth= 960
+                    )
+
+
 trial_text = {
      None : visual.TextStim(exp_win,
             text=None,
@@ -452,6 +398,8 @@ buttons = {
                     lineColor="white",
                     pos=(-400, -300)),
 }
+if args.headless:
+    headless.participant.buttons = buttons
 
 # #Test questions
 rating_stim = { "familiarisation": visual.Slider(exp_win,
@@ -507,160 +455,401 @@ for i in range(0,11):
                             height = 50,
                             text=str(i))
 
+# render the fixed parts of the expectancy screen (text, slider line, ticks and labels) once,
+# so each countdown frame only draws the cached image, the digit and the marker
+if composite_static_layers:
+    exp_rating.reset() # no marker in the cached image
+    static_layers = {"control": visual.BufferImageStim(exp_win, stim=[trial_text["expectancy"], exp_rating]),
+                     "RENS": visual.BufferImageStim(exp_win, stim=[RENS_image, trial_text["expectancy"], exp_rating])}
+    exp_rating.reset()
+else:
+    static_layers = None
+
+# lay out every fixed text before the first trial
+for text in instructions_text.values():
+    text_stims.preload(text, **textStim_arguments)
+text_stims.preload(continue_text, **continue_text_arguments)
+text_stims.preload(instructions_text["end"], **exit_text_arguments)
+text_stims.preload(instructions_text["termination"], **exit_text_arguments)
+text_stims.preload(response_instructions["familiarisation"], **familiarisation_text_arguments)
+text_stims.preload(response_instructions["choice"], **choice_text_arguments)
+# prompts drawn inside trial loops, looked up once here instead of on every frame
+familiarisation_prompt = text_stims.get(response_instructions["familiarisation"], **familiarisation_text_arguments)
+choice_prompt = text_stims.get(response_instructions["choice"], **choice_text_arguments)
+
+startup_times["stimuli"] = time.perf_counter() - startup_timer - startup_times["psychopy"] - startup_times["window"]
+
+# warm-up: load every image in stimuli/ and draw every stimulus once into the back buffer, which is cleared
+# and never shown, so textures are uploaded and shaders compiled before the welcome screen instead of mid-trial
+stimulus_images = {filename: visual.ImageStim(exp_win,
+                                              image = os.path.join(stimulus_folder, filename),
+                                              size = RENS_image_size,
+                                              pos = RENS_image_pos)
+                   for filename in sorted(os.listdir(stimulus_folder)) if filename.lower().endswith(".png")}
+warmup_stims = [fix_stim, RENS_image, RENS_text,
+                *countdown_text.values(), *trial_text.values(), *button_text.values(), *buttons.values(),
+                *stimulus_images.values(), *text_stims.preloaded.values(), *(static_layers or {}).values()]
+for stim in warmup_stims:
+    stim.draw()
+for slider in rating_stim.values():
+    slider.draw()
+    slider.marker.draw() # the marker is only drawn once the slider has been clicked
+    slider.reset()
+exp_win.clearBuffer()
+startup_times["warm-up"] = time.perf_counter() - startup_timer - sum(startup_times.values())
+print("Startup: " + ", ".join(f"{name} {duration:.2f} s" for name, duration in startup_times.items()))
+
+# open the data files (header only), finished trials are appended as they happen
+data_writer = DataWriter(data_filepath,
+                         fieldnames = list(trial_order[0].keys()) + list(session_info.keys()),
+                         fsync = data_fsync,
+                         header = session_info)
+triggers_writer = DataWriter(triggers_filepath,
+                             fieldnames = ["trialnum", "time", "value", "rising", "falling", "pulse_width", "flip_latency"],
+                             fsync = data_fsync)
+frame_history = collections.defaultdict(list) # longest frame per trial for each phase, to check the warm-up worked
+if frame_timer:
+    frametimes_writer = DataWriter(frametimes_filepath,
+                                   fieldnames = ["trialnum", "phase", "frames", "mean_interval", "max_interval", "dropped_frames"],
+                                   fsync = data_fsync)
+if record_trajectories:
+    trajectory_recorder = TrajectoryRecorder(BinaryWriter(trajectories_filepath + ".bin", fsync = data_fsync),
+                                             DataWriter(trajectories_filepath + ".csv",
+                                                        fieldnames = ["trialnum", "start", "stop"],
+                                                        fsync = data_fsync))
+else:
+    trajectory_recorder = None
+if profile_session:
+    from profiling import SessionProfiler
+    profiler = SessionProfiler(profile_filepath + ".prof",
+                               DataWriter(profile_filepath + ".csv",
+                                          fieldnames = SessionProfiler.fieldnames,
+                                          fsync = data_fsync))
+else:
+    profiler = None
+if args.database:
+    from store import SessionStore
+    session_store = SessionStore(args.database, session_info, fsync = data_fsync)
+else:
+    session_store = None
+if args.monitor:
+    from monitor import SessionMonitor
+    session_monitor = SessionMonitor(args.monitor, session_info, frame_timing = record_frame_timing)
+else:
+    session_monitor = None
+critical_section = CriticalSection(critical_cpu, critical_nice) if critical_sections else None
+    
+#define waiting function so experiment doesn't freeze as it does with wait()
+def wait(time):
+    countdown_timer = clock.CountdownTimer(time)
+    while countdown_timer.getTime() > 0:
+        termination_check()
+        clock.idle(countdown_timer.getTime())
+        inputs.poll()
+
+# Slider.draw without the line, ticks and labels: take the mouse response and draw the marker
+# (placed from the slider's public pos, size and ticks, the rating sliders are all horizontal)
+def draw_marker(slider):
+    slider.getMouseResponses()
+    if slider.markerPos is not None:
+        low, high = slider.ticks[0], slider.ticks[-1]
+        slider.marker.pos = (slider.pos[0] + ((slider.markerPos - low) / (high - low) - 0.5) * slider.size[0], slider.pos[1])
+        slider.marker.draw()
+
+# expectancy question and slider, plus the RENS image once it is on
+def draw_expectancy_screen(show_RENS):
+    if static_layers:
+        static_layers["RENS" if show_RENS else "control"].draw() # drawn first, it covers the whole window
+        draw_marker(exp_rating)
+    else:
+        if show_RENS:
+            RENS_image.draw()
+        trial_text["expectancy"].draw()
+        exp_rating.draw()
+
+# mark the start of a trial section for frame timing and profiling, whichever are on
+# (frame timing only covers its own phases and pauses in between)
+def start_phase(phase, trialnum=None):
+    if frame_timer:
+        if phase in frame_timer.phases:
+            frame_timer.start(phase)
+        else:
+            frame_timer.stop()
+    if profiler:
+        profiler.start(phase, trialnum)
+
+#create instruction trials
+def instruction_trial(instructions, holdtime=0, key="space"):
+    start_phase("instruction", "")
+    instruction_stim = text_stims.get(instructions, **textStim_arguments)
+    instruction_stim.draw()
+    if key != None:
+        inputs.expect(key) # counts from when the instructions appear
+    flip()
+    wait(holdtime)
+    instruction_stim.draw()
+    if key == "space":
+        text_stims.get(continue_text, **continue_text_arguments).draw()
+    flip()
+
+    if key != None:
+        while True:
+            termination_check()
+            if inputs.take(key) is not None:
+                flip()
+                break
+            clock.idle()
+            inputs.poll()
+            
+    wait(2)
+
+# Create functions
+    # Save one finished trial (one queue put on the render thread)
+def save_data(trial):
+    data_writer.write(trial) # the Trial itself, session_info is joined on in the writer thread
+    if session_store:
+        session_store.write(trial)
+    for edge in pport.pop_edges():
+        triggers_writer.write({"trialnum": trial["trialnum"], **edge})
+    frame_rows = frame_timer.summarise(trial["trialnum"]) if frame_timer else []
+    for row in frame_rows:
+        frametimes_writer.write(row)
+        frame_history[row["phase"]].append(row["max_interval"])
+    if session_monitor:
+        session_monitor.publish(trial, frame_rows)
+    if trajectory_recorder:
+        trajectory_recorder.end_trial()
+
+    # Wait for every queued row to reach disk
+def close_data():
+    data_writer.close()
+    triggers_writer.close()
+    if session_store:
+        session_store.close()
+    if frame_timer:
+        frametimes_writer.close()
+    if trajectory_recorder:
+        trajectory_recorder.close()
+    if profiler:
+        profiler.close()
+
+    # Longest frame of the first trial against a typical later trial, for each phase (needs record_frame_timing)
+def print_warmup_check():
+    for phase, history in frame_history.items():
+        if len(history) > 1:
+            first, typical = history[0], statistics.median(history[1:])
+            print(f"Warm-up check, {phase}: longest frame {first * 1000:.2f} ms on the first trial, median {typical * 1000:.2f} ms on later trials"
+                  + (" (first trial slower)" if first - typical > frame_timer.frame_period / 2 else ""))
+
+    # Time from each trigger edge to the flip showing the matching screen, by trigger value
+    # How much later than the device timestamp polling read each space/return press
+def print_key_delays():
+    if inputs.delays:
+        print(f"Key detection delay: mean {sum(inputs.delays) / len(inputs.delays) * 1000:.2f} ms, max {max(inputs.delays) * 1000:.2f} ms"
+              f" over {len(inputs.delays)} presses (not in the saved RTs, which use the device timestamp)")
+
+def print_latency_summary():
+    for value, (edges, mean, sd, longest) in pport.latency_summary().items():
+        print(f"Trigger {value}: {edges} edges, flip latency mean {mean * 1000:.2f} ms, jitter (SD) {sd * 1000:.2f} ms, max {longest * 1000:.2f} ms")
+
+def exit_screen(instructions):
+    exp_win.flip()
+    text_stims.get(instructions, **exit_text_arguments).draw()
+    exp_win.flip()
+    event.waitKeys()
+    exp_win.close()
+    
+def termination_check(): #insert throughout experiment so participants can end at any point.
+    if inputs.aborted: # escape was pressed, read with the rest of the input by inputs.poll()
+        pport.set(0) # Set all pins to 0 to shut off context, RENS, shock etc.
+        if critical_section:
+            critical_section.exit()
+        # Save participant information
+
+        close_data()
+        print_latency_summary()
+        print_warmup_check()
+        print_key_delays()
+        if allocator:
+            allocator.finish(P_info["PID"], "terminated")
+        if session_monitor:
+            session_monitor.finish("terminated")
+        exit_screen(instructions_text["termination"])
+        core.quit()
+
+
 # Define button_text dictionaries
 #### Make trial functions
 def show_fam_trial(current_trial):
     termination_check()
+    if trajectory_recorder:
+        trajectory_recorder.start_trial(current_trial["trialnum"])
+    start_phase("prompt", current_trial["trialnum"])
     # Wait for participant to ready up for shock
-    visual.TextStim(exp_win,
-        text=response_instructions["familiarisation"],
-        height = 35,
-        pos = (0,0),
-        wrapWidth= 800
-        ).draw()
-    exp_win.flip()
-    event.waitKeys(keyList = ["space"])
+    familiarisation_prompt.draw()
+    inputs.expect("space")
+    prompt_onset = flip()
+    press = inputs.take("space")
+    while press is None: # escape still works while waiting
+        termination_check()
+        clock.idle()
+        inputs.poll()
+        press = inputs.take("space")
+    key_time, current_trial["ready_delay"] = press # how much later polling noticed the press
+    current_trial["ready_rt"] = key_time - prompt_onset # device timestamp of the key press
     
     # show fixation stimulus + deliver shock
-    if pport != None:
-        pport.setData(0)
+    start_phase("stimulus")
+    pport.set(0)
 
     fix_stim.draw()
-    exp_win.flip()
-    
-    if pport != None:
-        pport.setData(pain_trig+eda_trig)
-        core.wait(port_buffer_duration)
-        pport.setData(0)
+    pport.pulse(pain_trig+eda_trig, port_buffer_duration) # raised for the fixation flip, resets itself so the rating slider shows straight away
+    flip()
     
     # Get pain rating
+    start_phase("pain_rating")
+    response_timer.start()
     while fam_rating.getRating() is None: # while mouse unclicked
         termination_check()
         trial_text["pain"].draw()
         fam_rating.draw()
-        exp_win.flip()
+        record_slider("pain_rating", fam_rating)
+        response_timer.shown(flip())
+    current_trial["pain_rt"] = response_timer.stop() # the press, the slider takes its rating on release
          
-    pain_response_end_time = core.getTime() + response_hold_duration # amount of time for participants to adjust slider after making a response
+    pain_response_end_time = clock.getTime() + response_hold_duration # amount of time for participants to adjust slider after making a response
     
-    while core.getTime() < pain_response_end_time:
+    while clock.getTime() < pain_response_end_time:
         termination_check()
         trial_text["pain"].draw()
         fam_rating.draw()
-        exp_win.flip()
+        record_slider("pain_rating", fam_rating)
+        flip()
 
     current_trial["pain_response"] = fam_rating.getRating()
     fam_rating.reset()
+    start_phase("save")
+    save_data(current_trial)
     
-    exp_win.flip()
-    core.wait(familiarisation_iti)
+    start_phase("iti")
+    flip()
+    wait(familiarisation_iti)
     
 def show_trial(current_trial):
-    if pport != None:
-        pport.setData(0)
+    start_phase("choice", current_trial["trialnum"])
+    pport.set(0)
+    if trajectory_recorder:
+        trajectory_recorder.start_trial(current_trial["trialnum"])
         
-    exp_win.flip()
+    flip()
 
         #If RENS trial, ask for choice:
-    
-    for button_name in button_text:
-        buttons[button_name].draw()
-        button_text[button_name].draw()
-
-        
-    visual.TextStim(exp_win,
-            text=response_instructions["choice"],
-            height = 35,
-            pos = (0,0),
-            ).draw()
-        
-    exp_win.flip()
-
     choice_finish = False
-    mouse = event.Mouse()
+    inputs.watch_buttons(buttons)
+    response_timer.start()
    
-
-    while choice_finish == False:
+    while choice_finish == False: # redrawn and flipped every frame so polling is paced by the refresh
         termination_check()
-        for button_name, button_rect in buttons.items():
-            if mouse.isPressedIn(button_rect):
-                current_trial["stimulus"] = button_name
-                choice_finish = True
-
+        for button_name in button_text:
+            buttons[button_name].draw()
+            button_text[button_name].draw()
+        choice_prompt.draw()
+        response_timer.shown(flip())
+
+        clicked = inputs.take_click() # buttons are hit-tested in inputs.poll()
+        if clicked is not None:
+            current_trial["stimulus"] = clicked
+            choice_finish = True
+    current_trial["choice_rt"] = response_timer.stop()
     
     # Start countdown to shock
     
-    # Make a count-down screen
-    countdown_timer = core.CountdownTimer(10)  # Set the initial countdown time to 10 seconds
-  
-    while countdown_timer.getTime() > 7:
+    # Make a count-down screen, one pass of each loop is one frame
+    start_phase("countdown")
+    if critical_section:
+        critical_section.enter()
+    for digit in countdown_frames["countdown"]:
         termination_check()
-        countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
-        exp_win.flip()
+        countdown_text[digit].draw()
+        flip()
+
+    start_phase("expectancy")
+    response_timer.start()
 
-    while countdown_timer.getTime() < 7 and countdown_timer.getTime() > 4: #ask for expectancy at 7 seconds
+    for digit in countdown_frames["expectancy"]: #ask for expectancy at 7 seconds
         termination_check()
-        if pport != None:
-            pport.setData(tens_trig[current_trial["stimulus"]])
-        countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
+        pport.set(tens_trig[current_trial["stimulus"]]) # only written on the first frame
         
         # Ask for expectancy rating
-        trial_text["expectancy"].draw() 
-        exp_rating.draw()
-        exp_win.flip()    
-
-            
-    while countdown_timer.getTime() < 4 and countdown_timer.getTime() > 0: #turn on RENS at 8 seconds if chosen
+        draw_expectancy_screen(show_RENS=False)
+        countdown_text[digit].draw()
+        record_slider("expectancy", exp_rating)
+        response_timer.shown(flip())
+        if current_trial["expectancy_touch"] is None and exp_rating.markerPos is not None: # set on press, the rating only on release
+            current_trial["expectancy_touch"] = response_timer.stop()
+
+    start_phase("heat")
+    for digit in countdown_frames["heat"]: #turn on RENS at 4 seconds if chosen
         termination_check()
-        if current_trial["stimulus"] == "RENS":
-            RENS_image.draw()
-                        
     # start heat ramp
-        if pport != None:
-            pport.setData(tens_trig[current_trial["stimulus"]]+pain_trig[current_trial["outcome"]])
-
-        countdown_text[str(int(math.ceil(countdown_timer.getTime())))].draw()
+        pport.set(tens_trig[current_trial["stimulus"]]+pain_trig) # heat level is set on the CHEPS
         
         # Keep expectancy rating
-        trial_text["expectancy"].draw() 
-        exp_rating.draw()
-        exp_win.flip()    
+        draw_expectancy_screen(show_RENS=current_trial["stimulus"] == "RENS")
+        countdown_text[digit].draw()
+        record_slider("heat", exp_rating)
+        flip()
+        if current_trial["expectancy_touch"] is None and exp_rating.markerPos is not None: # set on press, the rating only on release
+            current_trial["expectancy_touch"] = response_timer.stop()
 
+    if critical_section:
+        critical_section.exit()
+    start_phase("fixation")
 
     current_trial["exp_response"] = exp_rating.getRating() #saves the expectancy response for that trial
     exp_rating.reset() #resets the expectancy slider for subsequent trials
 
-    if pport != None:
-        pport.setData(0)
+    pport.set(0)
         
     fix_stim.draw()
-    exp_win.flip()
+    flip()
 
     wait(0.5)
 
     # Get pain rating
+    start_phase("pain_rating")
+    response_timer.start()
     while pain_rating.getRating() is None: # while mouse unclicked
         termination_check()
         pain_rating.draw()
         trial_text["pain"].draw()
-        exp_win.flip()
+        record_slider("pain_rating", pain_rating)
+        response_timer.shown(flip())
+    current_trial["pain_rt"] = response_timer.stop() # the press, the slider takes its rating on release
             
             
-    pain_response_end_time = core.getTime() + response_hold_duration # amount of time for participants to adjust slider after making a response
+    pain_response_end_time = clock.getTime() + response_hold_duration # amount of time for participants to adjust slider after making a response
     
-    while core.getTime() < pain_response_end_time:
+    while clock.getTime() < pain_response_end_time:
         termination_check()
         trial_text["pain"].draw()
         pain_rating.draw()
-        exp_win.flip()
+        record_slider("pain_rating", pain_rating)
+        flip()
         
     current_trial["pain_response"] = pain_rating.getRating()
     pain_rating.reset()
+    start_phase("save")
+    save_data(current_trial)
 
-    exp_win.flip()
+    start_phase("iti")
+    flip()
+    if critical_section:
+        critical_section.collect()
     
     wait(iti)
 
-exp_finish = None        
+exp_finish = args.setup_only or None
 lastblocknum = None
 
 # Run experiment
@@ -669,46 +858,41 @@ while not exp_finish:
     termination_check()
     
     # # # ### introduce RENS and run familiarisation procedure
-<<<<<<< HEAD
-    instruction_trial(instructions=instructions_text["blockname_text"],spacebar_text=None,key="return")
-    instruction_trial(instructions_text["welcome"],3)
-=======
     instruction_trial(instructions=instructions_text["blockname_text"],key="return")
     instruction_trial(instructions_text["welcome"],2)
->>>>>>> origin/main
     instruction_trial(instructions_text["RENS_introduction"],6)
     instruction_trial(instructions_text["familiarisation_1"],10)
     instruction_trial(instructions_text["familiarisation_2"],10)
      
-    for trial in list(filter(lambda trial: trial['phase'] == "familiarisation", trial_order)):
+    for trial in schedule.phase("familiarisation"):
         show_fam_trial(trial)
     instruction_trial(instructions_text["familiarisation_finish"],2)
 
-<<<<<<< HEAD
-    instruction_trial(instructions_text["conditioning"],10)
-    instruction_trial(instructions_text["calibration"],spacebar_text=None,key="return")
-    
-=======
     instruction_trial(instructions_text["calibration"],key="return")
->>>>>>> origin/main
-    for trial in list(filter(lambda trial: trial['phase'] == "calibration", trial_order)):
+    for trial in schedule.phase("calibration"):
         show_fam_trial(trial)
         
     instruction_trial(instructions_text["calibration_finish"],holdtime = 3, key = None)
     instruction_trial(instructions_text["conditioning"],key="return")
     
-    for trial in list(filter(lambda trial: trial['phase'] == "conditioning", trial_order)):
-        current_blocknum = trial['blocknum']
-        if lastblocknum is not None and current_blocknum != lastblocknum:
+    for blocknum, block_trials in schedule.blocks("conditioning"):
+        if lastblocknum is not None:
             instruction_trial(instructions_text["blockrest"],key="return")
-        show_trial(trial)
-        lastblocknum = current_blocknum
+        for trial in block_trials:
+            show_trial(trial)
+        lastblocknum = blocknum
 
-    if pport != None:
-        pport.setData(0)
+    pport.set(0)
         
-    # save trial data
-    save_data(trial_order)
+    # make sure every trial is on disk
+    close_data()
+    print_latency_summary()
+    print_warmup_check()
+    print_key_delays()
+    if allocator:
+        allocator.finish(P_info["PID"], "complete")
+    if session_monitor:
+        session_monitor.finish("complete")
     exit_screen(instructions_text["end"])
     
     exp_finish = True
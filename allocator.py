@@ -0,0 +1,72 @@
+# Hands out participant IDs, group, cb and block order to several testing booths at once
+# from one SQLite registry (put the file in a folder every booth can reach)
+#   python allocator.py REGISTRY     show how many sessions each cell has
+import itertools
+import json
+import random
+import socket
+import sqlite3
+import time
+
+from schedule import counterbalancing
+
+block_orders = [list(block_order) for block_order in itertools.permutations([1, 2, 3, 4])]
+counted_statuses = ("allocated", "complete") # terminated and skipped sessions get replaced
+
+class SessionAllocator:
+    def __init__(self, registry_path, timeout=10):
+        self.db = sqlite3.connect(registry_path, timeout=timeout, isolation_level=None) # transactions are explicit
+        self.db.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                               PID INTEGER PRIMARY KEY,
+                               station TEXT,
+                               grp INTEGER,
+                               cb INTEGER,
+                               groupname TEXT,
+                               blockorder TEXT,
+                               status TEXT,
+                               allocated TEXT)""")
+
+    # PID % 6 sets the cell, so the least used cell is picked first and then its next free PID
+    def allocate(self, station=None, rng=random):
+        self.db.execute("BEGIN IMMEDIATE") # only one booth allocates at a time
+        try:
+            sessions = self.db.execute("SELECT PID, blockorder, status FROM sessions").fetchall()
+            next_pid = max([PID for PID, _, _ in sessions], default=0) + 1
+            cell_counts = {cell: 0 for cell in counterbalancing}
+            order_counts = {cell: {json.dumps(block_order): 0 for block_order in block_orders} for cell in counterbalancing}
+            for PID, blockorder, status in sessions:
+                if status in counted_statuses:
+                    cell_counts[PID % 6] += 1
+                    order_counts[PID % 6][blockorder] += 1
+
+            first_pid = {cell: next_pid + (cell - next_pid) % 6 for cell in counterbalancing}
+            cell = min(counterbalancing, key=lambda cell: (cell_counts[cell], first_pid[cell]))
+            PID = first_pid[cell]
+
+            fewest = min(order_counts[cell].values())
+            block_order = json.loads(rng.choice([order for order, count in order_counts[cell].items() if count == fewest]))
+
+            group, cb, groupname = counterbalancing[cell]
+            self.db.execute("INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (PID, station or socket.gethostname(), group, cb, groupname, json.dumps(block_order),
+                             "allocated", time.strftime("%Y-%m-%d_%H.%M.%S")))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return {"PID": PID, "group": group, "cb": cb, "groupname": groupname, "block_order": block_order}
+
+    def finish(self, PID, status="complete"): # complete, terminated or skipped
+        self.db.execute("UPDATE sessions SET status = ? WHERE PID = ?", (status, int(PID)))
+
+    def cell_counts(self):
+        return self.db.execute("""SELECT grp, cb, groupname, status, COUNT(*) FROM sessions
+                                  GROUP BY grp, cb, status ORDER BY cb, grp, status""").fetchall()
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2:
+        raise SystemExit("usage: python allocator.py REGISTRY")
+    for group, cb, groupname, status, count in SessionAllocator(sys.argv[1]).cell_counts():
+        print(f"{groupname:<16}cb {cb}  {status:<12}{count:>5}")
@@ -0,0 +1,110 @@
+# Batch analysis of every <PID>_responses.csv in the data folder
+#   python analysis.py [data_folder] [--workers N] [--output summary.csv]
+# Sessions are loaded in parallel into NumPy columns, then summarised per group, block and outcome
+import argparse
+import csv
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+phases = ["familiarisation", "calibration", "conditioning", "extinction"]
+outcomes = ["high", "low3", "low4", "low5", "med"]
+groupnames = {1: "highOD", 2: "lowOD", 3: "naturalhistory"}
+
+phase_codes = {phase: code for code, phase in enumerate(phases)}
+outcome_codes = {outcome: code for code, outcome in enumerate(outcomes)}
+choice_codes = {"RENS": 1.0, "control": 0.0}
+
+def to_float(value):
+    return float(value) if value != "" else np.nan
+
+# Runs in a worker process: one session file -> dict of columns
+# Rows are read with csv.reader and each needed field is appended straight to its column by header position
+def load_session(filepath):
+    fields = ["PID", "group", "phase", "blocknum", "outcome", "stimulus", "exp_response", "pain_response"]
+    values = {field: [] for field in fields}
+    with open(filepath, newline="") as csv_file:
+        reader = csv.reader(csv_file)
+        header = next(reader)
+        appends = [(header.index(field), values[field].append) for field in fields]
+        for row in reader:
+            for i, append in appends:
+                append(row[i])
+    return {
+        "PID": np.array([int(value) for value in values["PID"]], dtype=np.int64),
+        "group": np.array([int(value) for value in values["group"]], dtype=np.int8),
+        "phase": np.array([phase_codes[value] for value in values["phase"]], dtype=np.int8),
+        "blocknum": np.array([int(value or 0) for value in values["blocknum"]], dtype=np.int8),
+        "outcome": np.array([outcome_codes.get(value, -1) for value in values["outcome"]], dtype=np.int8),
+        "RENS": np.array([choice_codes.get(value, np.nan) for value in values["stimulus"]]), # 1 RENS, 0 control, nan no choice
+        "exp_response": np.array([to_float(value) for value in values["exp_response"]]),
+        "pain_response": np.array([to_float(value) for value in values["pain_response"]]),
+    }
+
+def load_folder(data_folder, workers=None):
+    filepaths = sorted(glob.glob(os.path.join(data_folder, "*_responses.csv")))
+    if not filepaths:
+        return None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        sessions = list(executor.map(load_session, filepaths, chunksize=16))
+    return {name: np.concatenate([session[name] for session in sessions]) for name in sessions[0]}
+
+# Mean of each column over every combination of the key columns (nan values are left out)
+def summarise(columns, keys):
+    cells, index = np.unique(np.stack([columns[key] for key in keys], axis=1), axis=0, return_inverse=True)
+    index = index.ravel()
+    summary = {key: cells[:, i] for i, key in enumerate(keys)}
+    summary["trials"] = np.bincount(index, minlength=len(cells))
+    for name in ["RENS", "exp_response", "pain_response"]:
+        values = columns[name]
+        valid = ~np.isnan(values)
+        total = np.bincount(index[valid], weights=values[valid], minlength=len(cells))
+        count = np.bincount(index[valid], minlength=len(cells))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            summary[name] = total / count
+    return summary
+
+def summary_rows(name, summary):
+    for i in range(len(summary["trials"])):
+        yield {"summary": name,
+               "group": groupnames.get(int(summary["group"][i])),
+               "blocknum": int(summary["blocknum"][i]) if "blocknum" in summary else None,
+               "outcome": outcomes[summary["outcome"][i]] if "outcome" in summary else None,
+               "trials": int(summary["trials"][i]),
+               "RENS_rate": summary["RENS"][i],
+               "mean_expectancy": summary["exp_response"][i],
+               "mean_pain": summary["pain_response"][i]}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_folder", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+    parser.add_argument("--workers", type=int, help="number of processes (default: one per core)")
+    parser.add_argument("--output", help="also write the summaries to this CSV file")
+    args = parser.parse_args()
+
+    columns = load_folder(args.data_folder, args.workers)
+    if columns is None:
+        raise SystemExit(f"No *_responses.csv files in {args.data_folder}")
+
+    conditioning = columns["phase"] == phase_codes["conditioning"]
+    conditioning_columns = {name: values[conditioning] for name, values in columns.items()}
+
+    rows = []
+    for name, keys in [("group", ["group"]),
+                       ("group x block", ["group", "blocknum"]),
+                       ("group x outcome", ["group", "outcome"])]:
+        rows.extend(summary_rows(name, summarise(conditioning_columns, keys)))
+
+    print(f"{len(np.unique(columns['PID']))} sessions, {len(columns['PID'])} trials (conditioning trials summarised)")
+    print(f"{'summary':<16}{'group':<16}{'block':>6}{'outcome':>8}{'trials':>8}{'RENS':>8}{'exp':>8}{'pain':>8}")
+    for row in rows:
+        print(f"{row['summary']:<16}{row['group']:<16}{row['blocknum'] or '':>6}{row['outcome'] or '':>8}{row['trials']:>8}"
+              f"{row['RENS_rate']:>8.2f}{row['mean_expectancy']:>8.1f}{row['mean_pain']:>8.1f}")
+
+    if args.output:
+        with open(args.output, mode="w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
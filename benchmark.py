@@ -0,0 +1,126 @@
+# Benchmarks for the NC1.py trial loop hot paths, run on the headless window and a simulated port
+#   python benchmark.py              compare against the stored baseline, exit 1 if a path got slower
+#   python benchmark.py --save       store this machine's results as the baseline
+# Baselines are per machine, so they are kept out of git. Each path runs for at least --min-time per repeat,
+# the median repeat is compared, and the allowed slowdown grows with the spread measured between repeats
+import argparse
+import json
+import os
+import runpy
+import sys
+import tempfile
+import time
+import tracemalloc
+
+script_directory = os.path.dirname(os.path.abspath(__file__))
+script = os.path.join(script_directory, "NC1.py")
+
+# Load NC1.py headless up to the start of the session, so its functions can be called directly
+def load_session(data_folder):
+    argv = sys.argv
+    sys.argv = [script, "--headless", "--pid", "1", "--seed", "1", "--data-folder", data_folder, "--setup-only"]
+    try:
+        return runpy.run_path(script, run_name="NC1")
+    finally:
+        sys.argv = argv
+
+# each benchmark: name -> (function to time, iterations per batch)
+def make_benchmarks(nc1):
+    trials = {phase: [trial.copy() for trial in nc1["schedule"].phase(phase)] for phase in ["familiarisation", "conditioning"]}
+    instructions = nc1["instructions_text"]["conditioning"]
+
+    def next_trial(phase):
+        trial = trials[phase].pop(0)
+        trials[phase].append(trial)
+        return trial.copy()
+
+    return {
+        "termination_check": (nc1["termination_check"], 100000),
+        "instruction_trial": (lambda: nc1["instruction_trial"](instructions, key="return"), 50),
+        "show_fam_trial": (lambda: nc1["show_fam_trial"](next_trial("familiarisation")), 20),
+        "show_trial": (lambda: nc1["show_trial"](next_trial("conditioning")), 20),
+        "save_data": (lambda: nc1["save_data"](next_trial("conditioning")), 2000),
+    }
+
+def run_benchmark(function, batch, window, min_time):
+    function() # warm up caches and lazily created stimuli
+    flips = window.flips
+    iterations = 0
+    start_time = time.perf_counter()
+    while True: # whole batches until min_time has passed, so short paths are not timed over a few ms
+        for _ in range(batch):
+            function()
+        iterations += batch
+        elapsed = time.perf_counter() - start_time
+        if elapsed >= min_time:
+            break
+    flips = window.flips - flips
+
+    # memory in a second pass, tracemalloc slows everything down
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    start_memory = tracemalloc.get_traced_memory()[0]
+    for _ in range(batch):
+        function()
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    retained = tracemalloc.take_snapshot().compare_to(before, "filename")
+    tracemalloc.stop()
+    return {"per_iteration_us": elapsed / iterations * 1e6,
+            "iterations": iterations,
+            "flips_per_second": flips / elapsed,
+            "peak_kib": (peak_memory - start_memory) / 1024, # most memory in use at once above the starting point
+            "retained_blocks": sum(stat.count_diff for stat in retained) / batch} # still allocated afterwards, per iteration
+
+# Median of the repeats, with their spread (range over median) as the run-to-run noise for this path
+def median_run(runs):
+    runs = sorted(runs, key=lambda run: run["per_iteration_us"])
+    result = dict(runs[len(runs) // 2])
+    result["spread"] = (runs[-1]["per_iteration_us"] - runs[0]["per_iteration_us"]) / result["per_iteration_us"]
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--save", action="store_true", help="store these results as the baseline")
+    parser.add_argument("--baseline", default=os.path.join(script_directory, "benchmark_baseline.json"))
+    parser.add_argument("--threshold", type=float, default=1.25, help="fail if a path takes longer than this times its baseline, plus its measured spread")
+    parser.add_argument("--repeat", type=int, default=5, help="median of this many runs per path")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds each path runs for in every repeat")
+    args = parser.parse_args()
+
+    nc1 = load_session(tempfile.mkdtemp(prefix="NC1_benchmark_"))
+    benchmarks = make_benchmarks(nc1)
+    runs = {name: [] for name in benchmarks}
+    for _ in range(args.repeat): # repeats take turns across paths, so a slow spell on the machine shows up as spread
+        for name, (function, batch) in benchmarks.items():
+            runs[name].append(run_benchmark(function, batch, nc1["exp_win"], args.min_time))
+    results = {name: median_run(name_runs) for name, name_runs in runs.items()}
+    nc1["close_data"]()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    slower = []
+    print(f"{'path':<20}{'us/iter':>12}{'spread':>8}{'baseline':>12}{'ratio':>8}{'limit':>8}{'flips/s':>12}{'peak KiB':>10}{'kept/iter':>11}")
+    for name, result in results.items():
+        line = f"{name:<20}{result['per_iteration_us']:>12.2f}{result['spread']:>8.2f}"
+        if name in baseline:
+            ratio = result["per_iteration_us"] / baseline[name]["per_iteration_us"]
+            limit = args.threshold + max(result["spread"], baseline[name].get("spread", 0)) # noisier paths get more room
+            line += f"{baseline[name]['per_iteration_us']:>12.2f}{ratio:>8.2f}{limit:>8.2f}"
+            if ratio > limit:
+                slower.append(name)
+        else:
+            line += f"{'':>12}{'':>8}{'':>8}"
+        print(line + f"{result['flips_per_second']:>12.0f}{result['peak_kib']:>10.1f}{result['retained_blocks']:>11.2f}")
+
+    if args.save:
+        with open(args.baseline, mode="w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"No baseline at {args.baseline}, run with --save to store one")
+    elif slower:
+        sys.exit(f"Slower than baseline beyond the limit: {', '.join(slower)}")
@@ -0,0 +1,99 @@
+# Data files for NC1 sessions (no PsychoPy needed)
+import csv
+import os
+import queue
+import threading
+
+# Base for the background writers: the thread opens its file before the constructor returns, and if the
+# thread fails (file can't be opened, disk full) the error is raised again on the next write() or close()
+class WriterThread:
+    def start_thread(self, path):
+        self.path = path
+        self.error = None
+        self.queue = queue.Queue()
+        self.opened = threading.Event()
+        self.thread = threading.Thread(target=self.run_thread, daemon=True)
+        self.thread.start()
+        self.opened.wait()
+        self.check()
+
+    def run_thread(self):
+        try:
+            self.run() # sets self.opened once its file is open
+        except Exception as error:
+            self.error = error
+        finally:
+            self.opened.set()
+
+    def check(self):
+        if self.error is not None:
+            raise RuntimeError(f"Writing {self.path} failed: {self.error}") from self.error
+
+    def close(self): # blocks until everything queued is on disk
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.check()
+
+# Appends rows to a CSV file from a background thread so disk I/O never stalls a flip
+# header: fields that are the same on every row (e.g. the session info), only joined on in the writer thread
+class DataWriter(WriterThread):
+    def __init__(self, filepath, fieldnames, fsync=True, header=None):
+        self.filepath = filepath
+        self.fieldnames = fieldnames
+        self.fsync = fsync
+        self.header = header or {}
+        self.start_thread(filepath)
+
+    def write(self, row):
+        self.check()
+        self.queue.put(row)
+
+    def flush(self, csv_file):
+        csv_file.flush()
+        if self.fsync:
+            os.fsync(csv_file.fileno())
+
+    def run(self):
+        new_file = not os.path.exists(self.filepath) or os.path.getsize(self.filepath) == 0
+        with open(self.filepath, mode="a", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=self.fieldnames, extrasaction="ignore")
+            if new_file:
+                writer.writeheader()
+                self.flush(csv_file)
+            self.opened.set()
+
+            finished = False
+            while not finished:
+                rows = [self.queue.get()]
+                while not self.queue.empty(): # write any backlog in one go before syncing
+                    rows.append(self.queue.get())
+                for row in rows:
+                    if row is None:
+                        finished = True
+                        break
+                    writer.writerow({**row, **self.header})
+                self.flush(csv_file)
+
+# Appends raw bytes (e.g. packed NumPy records) to a binary file from a background thread
+class BinaryWriter(WriterThread):
+    def __init__(self, filepath, fsync=True):
+        self.filepath = filepath
+        self.fsync = fsync
+        self.start_thread(filepath)
+
+    def write(self, data):
+        self.check()
+        self.queue.put(data)
+
+    def run(self):
+        with open(self.filepath, mode="ab") as binary_file:
+            self.opened.set()
+            while True:
+                data = self.queue.get()
+                if data is None:
+                    break
+                binary_file.write(data)
+                binary_file.flush()
+                if self.fsync:
+                    os.fsync(binary_file.fileno())
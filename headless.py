@@ -0,0 +1,225 @@
+# Headless stand-ins for the parts of PsychoPy used by NC1.py, driven by a virtual clock
+# so a whole session runs faster than real time with scripted participant responses.
+#   python NC1.py --headless --pid 7     run one session
+#   python headless.py                   run every PID-mod-6 cell and check the data files
+import random
+import types
+
+### Virtual time
+class VirtualCountdownTimer:
+    def __init__(self, clock, duration):
+        self.clock = clock
+        self.start_time = clock.getTime()
+        self.duration = duration
+
+    def getTime(self):
+        return self.duration - (self.clock.getTime() - self.start_time)
+
+class VirtualTimer: # same interface as threading.Timer, fires when the clock passes its due time
+    def __init__(self, clock, interval, function, args=()):
+        self.clock = clock
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.due = None
+
+    def start(self):
+        self.due = self.clock.getTime() + self.interval
+        self.clock.timers.append(self)
+
+    def cancel(self):
+        if self in self.clock.timers:
+            self.clock.timers.remove(self)
+
+class VirtualClock:
+    def __init__(self, frame_period=1/60):
+        self.time = 0.0
+        self.frame_period = frame_period
+        self.timers = []
+
+    def getTime(self):
+        return self.time
+
+    def advance(self, duration):
+        self.time += duration
+        for timer in [timer for timer in self.timers if timer.due <= self.time]:
+            self.timers.remove(timer)
+            timer.function(*timer.args)
+
+    def idle(self, timeout=None): # nothing to do until the next poll, skip ahead a frame
+        self.advance(self.frame_period)
+
+    def wait(self, duration):
+        self.advance(duration)
+
+    def CountdownTimer(self, duration):
+        return VirtualCountdownTimer(self, duration)
+
+    def Timer(self, interval, function, args=()):
+        return VirtualTimer(self, interval, function, args)
+
+### Scripted participant
+class ScriptedParticipant:
+    def __init__(self, seed=None, p_RENS=0.5, response_time_range=(0.5, 1.5)):
+        self.random = random.Random(seed)
+        self.p_RENS = p_RENS
+        self.response_time_range = response_time_range
+        self.buttons = {} # NC1.py registers its choice buttons here so clicks can be hit-tested
+        self.presses = [] # times of every mouse press, for timestamped response times
+        self.keys = set() # keys NC1.py is waiting for, pressed on the next poll
+
+    def choice(self):
+        return "RENS" if self.random.random() < self.p_RENS else "control"
+
+    def rating(self):
+        return round(self.random.uniform(0, 100), 1)
+
+    def response_time(self):
+        return self.random.uniform(*self.response_time_range)
+
+clock = VirtualClock()
+participant = ScriptedParticipant()
+
+### Window, stimuli and input
+class Stim: # TextStim, ImageStim and Rect: keeps its arguments, drawing does nothing
+    def __init__(self, win=None, **kwargs):
+        self.win = win
+        self.__dict__.update(kwargs)
+
+    def draw(self):
+        pass
+
+class Slider(Stim): # the participant settles on a rating some time after the slider first appears
+    def __init__(self, win=None, **kwargs):
+        super().__init__(win, **kwargs)
+        self.marker = Stim()
+        self.validArea = Stim()
+        self.reset()
+
+    def reset(self):
+        self.shown = None
+        self.rating = None
+        self.response_time = None
+
+    def getMouseResponses(self):
+        if self.shown is None:
+            self.shown = clock.getTime()
+            self.rating = participant.rating()
+            self.response_time = participant.response_time()
+            participant.presses.append(self.shown + self.response_time)
+
+    def draw(self):
+        self.getMouseResponses()
+
+    def getRating(self):
+        if self.shown is not None and clock.getTime() - self.shown >= self.response_time:
+            return self.rating
+        return None
+
+    @property
+    def markerPos(self):
+        return self.getRating()
+
+class BufferImageStim(Stim): # draws its stimuli once, like the real one does when it captures them
+    def __init__(self, win=None, stim=(), **kwargs):
+        super().__init__(win, **kwargs)
+        for stimulus in stim:
+            stimulus.draw()
+
+class Window:
+    def __init__(self, **kwargs):
+        self.mouseVisible = True
+        self.flips = 0
+
+    def flip(self):
+        self.flips += 1
+        clock.advance(clock.frame_period)
+        return clock.getTime()
+
+    def clearBuffer(self):
+        pass
+
+    def getActualFrameRate(self):
+        return 1 / clock.frame_period
+
+    def close(self):
+        pass
+
+class Mouse: # clicks land between frames and keep those times (real PsychoPy stamps them when it dispatches the event)
+    def __init__(self, **kwargs):
+        self.choice = None
+        self.press_time = None
+        self.reset_time = 0.0
+
+    def isPressedIn(self, shape):
+        if self.choice is None:
+            self.choice = participant.choice()
+            self.press_time = clock.getTime() + participant.response_time()
+            participant.presses.append(self.press_time)
+        return clock.getTime() >= self.press_time and shape is participant.buttons.get(self.choice)
+
+    def getPos(self):
+        return (0.0, 0.0)
+
+    def clickReset(self): # a new screen, so a new choice
+        self.reset_time = clock.getTime()
+        self.choice = None
+
+    def getPressed(self, getTime=False):
+        presses = [press for press in participant.presses if self.reset_time < press <= clock.getTime()]
+        if getTime:
+            return [1 if presses else 0, 0, 0], [presses[-1] - self.reset_time if presses else 0.0, 0.0, 0.0]
+        return [1 if presses else 0, 0, 0]
+
+def getKeys(keyList=None): # awaited keys are pressed straight away, escape never is
+    return [key for key in (participant.keys if keyList is None else keyList) if key != "escape"]
+
+def waitKeys(keyList=None):
+    return getKeys(keyList) or ["space"]
+
+class KeyPress:
+    def __init__(self, name, rt):
+        self.name = name
+        self.rt = rt
+
+class Keyboard: # psychopy.hardware.keyboard.Keyboard, presses are timestamped on the virtual clock
+    def __init__(self, **kwargs):
+        pass
+
+    def getKeys(self, keyList=None, waitRelease=True):
+        return [KeyPress(key, clock.getTime()) for key in getKeys(keyList)]
+
+def quit():
+    raise SystemExit
+
+core = types.SimpleNamespace(getTime=clock.getTime, CountdownTimer=clock.CountdownTimer, wait=clock.wait, quit=quit,
+                             monotonicClock=clock)
+event = types.SimpleNamespace(getKeys=getKeys, waitKeys=waitKeys, Mouse=Mouse)
+keyboard = types.SimpleNamespace(Keyboard=Keyboard)
+visual = types.SimpleNamespace(Window=Window, TextStim=Stim, ImageStim=Stim, Rect=Stim, Slider=Slider,
+                               BufferImageStim=BufferImageStim)
+
+if __name__ == "__main__":
+    import csv
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    import time
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "NC1.py")
+    data_folder = tempfile.mkdtemp(prefix="NC1_headless_")
+    start_time = time.perf_counter()
+
+    # PIDs 1-6 cover every group x cb cell
+    for pid in range(1, 7):
+        subprocess.run([sys.executable, script, "--headless", "--pid", str(pid), "--seed", str(pid), "--data-folder", data_folder],
+                       check=True, stdout=subprocess.DEVNULL)
+        with open(os.path.join(data_folder, f"{pid}_responses.csv"), newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+        missing = [row["trialnum"] for row in rows if row["pain_response"] == ""]
+        if missing:
+            sys.exit(f"PID {pid}: no pain response saved for trials {missing}")
+        print(f"PID {pid}: {rows[0]['groupname']}, cb {rows[0]['cb']}, {len(rows)} trials saved")
+
+    print(f"All cells finished in {time.perf_counter() - start_time:.2f} s, data in {data_folder}")
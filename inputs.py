@@ -0,0 +1,55 @@
+# Keyboard and mouse input for NC1, read in one place once per frame (or once per poll while idle)
+# keyboard is a psychopy.hardware.keyboard.Keyboard whose key.rt is on the clock.getTime() timebase
+# (headless.keyboard.Keyboard for headless runs), mouse is an event.Mouse
+class InputDispatcher:
+    def __init__(self, keyboard, mouse, clock):
+        self.keyboard = keyboard
+        self.mouse = mouse # the only Mouse for the session
+        self.clock = clock
+        self.handlers = {} # key -> handler(key, key_time), called as soon as the key is read
+        self.awaiting = set() # keys a screen is waiting for
+        self.keys = {} # key -> (time, delay) of its latest press that has not been taken yet
+        self.delays = [] # how much later than the press polling read each taken key, for the session summary
+        self.buttons = {} # name -> shape, hit-tested while a choice is on screen
+        self.clicked = None
+        self.aborted = False
+
+    def on_key(self, key, handler):
+        self.handlers[key] = handler
+
+    def abort(self, key, key_time): # handler for the escape key, termination_check() does the rest
+        self.aborted = True
+
+    def poll(self):
+        for key in self.keyboard.getKeys(waitRelease=False): # every press since the last poll, with its device timestamp
+            if key.name in self.handlers:
+                self.handlers[key.name](key.name, key.rt)
+            else:
+                self.keys[key.name] = (key.rt, self.clock.getTime() - key.rt) # delay: press to the poll that read it
+        if self.buttons and self.clicked is None:
+            for name, shape in self.buttons.items():
+                if self.mouse.isPressedIn(shape):
+                    self.clicked = name
+                    break
+
+    def expect(self, key): # presses from earlier screens do not count
+        self.keys.pop(key, None)
+        self.awaiting.add(key)
+
+    def take(self, key): # (time, delay) of the press once it has arrived, otherwise None
+        press = self.keys.pop(key, None)
+        if press is not None:
+            self.awaiting.discard(key)
+            self.delays.append(press[1])
+        return press
+
+    def watch_buttons(self, buttons):
+        self.buttons = buttons
+        self.clicked = None
+
+    def take_click(self): # name of the button clicked since watch_buttons(), otherwise None
+        clicked = self.clicked
+        if clicked is not None:
+            self.buttons = {}
+            self.clicked = None
+        return clicked
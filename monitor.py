@@ -0,0 +1,107 @@
+# Live session status for the experimenter, served over HTTP as JSON from a background thread
+#   python NC1.py --monitor 8765                 serve on localhost:8765
+#   python NC1.py --monitor 0.0.0.0:8765         let other machines on the lab network watch too
+#   python monitor.py booth1:8765 booth2:8765    watch several booths from one laptop
+# The render thread only puts each finished trial on a queue, the server thread does everything else
+import asyncio
+import collections
+import json
+import queue
+import threading
+import time
+
+def parse_address(address, default_host="127.0.0.1"):
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port)
+
+class SessionMonitor:
+    def __init__(self, address, session_info, frame_timing=False): # frame_timing: whether frame rows are published
+        self.host, self.port = parse_address(address)
+        self.queue = queue.SimpleQueue()
+        self.status = {"PID": session_info["PID"],
+                       "groupname": session_info["groupname"],
+                       "cb": session_info["cb"],
+                       "started": session_info["datetime"],
+                       "state": "running",
+                       "trials": 0,
+                       "updated": None,
+                       "trial": None,
+                       "dropped_frames": 0 if frame_timing else "not recorded",
+                       "longest_frame": None if frame_timing else "not recorded"}
+        self.frame_timing = frame_timing
+        self.recent = collections.deque(maxlen=12) # latest choices and ratings
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def publish(self, trial, frame_rows=()): # the only call made from the render thread, once per trial
+        self.queue.put((time.time(), trial, frame_rows)) # stamped when the trial finished, not when someone asks
+
+    def finish(self, state="complete"): # complete or terminated
+        self.queue.put(state)
+
+    def update(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if isinstance(item, str):
+                self.status["state"] = item
+                continue
+            finished, trial, frame_rows = item
+            self.status["trials"] += 1
+            self.status["updated"] = time.strftime("%H:%M:%S", time.localtime(finished))
+            self.status["trial"] = {field: trial[field] for field in ["trialnum", "phase", "blocknum", "outcome",
+                                                                          "stimulus", "exp_response", "pain_response"]}
+            self.recent.append({field: trial[field] for field in ["trialnum", "stimulus", "exp_response", "pain_response"]})
+            for row in frame_rows: # only sent when frame timing is recorded
+                self.status["dropped_frames"] += row["dropped_frames"]
+                self.status["longest_frame"] = max(self.status["longest_frame"] or 0, row["max_interval"])
+
+    async def respond(self, reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n") # any request gets the status
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+        self.update()
+        body = json.dumps({**self.status, "recent": list(self.recent)}, indent=2).encode()
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\nConnection: close\r\n"
+                     + f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+        await writer.drain()
+        writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.respond, self.host, self.port)
+        print(f"Session monitor on http://{self.host}:{self.port}")
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        try:
+            asyncio.run(self.serve())
+        except OSError as error: # e.g. the port is taken, the session carries on without a monitor
+            print(f"Session monitor not started: {error}")
+
+if __name__ == "__main__":
+    import sys
+    import urllib.request
+
+    if len(sys.argv) < 2:
+        raise SystemExit("usage: python monitor.py [HOST:]PORT ...")
+    while True:
+        for address in sys.argv[1:]:
+            host, port = parse_address(address)
+            try:
+                with urllib.request.urlopen(f"http://{host}:{port}/", timeout=1) as response:
+                    status = json.load(response)
+            except OSError as error:
+                print(f"{address:<22}unreachable ({error})")
+                continue
+            trial = {field: "-" if value is None else value for field, value in (status["trial"] or {}).items()}
+            print(f"{address:<22}PID {status['PID']:<6}{status['groupname']:<16}{status['state']:<12}"
+                  f"trial {trial.get('trialnum', '-'):<4}{trial.get('phase', ''):<16}block {trial.get('blocknum', '-'):<3}"
+                  f"{trial.get('stimulus', ''):<9}exp {trial.get('exp_response', '-'):<6}pain {trial.get('pain_response', '-'):<6}"
+                  f"dropped frames {status['dropped_frames']}, updated {status['updated'] or '-'}")
+        print()
+        time.sleep(2)
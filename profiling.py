@@ -0,0 +1,63 @@
+# Opt-in session profiling for NC1 (no PsychoPy needed)
+# Writes <PID>_profile.prof (cProfile stats for the whole session, open with pstats or snakeviz)
+# and <PID>_profile.csv (wall time, CPU time and garbage collections for every trial section)
+import cProfile
+import gc
+import time
+
+# Sections run back to back: starting one ends the one before, and each ends as a row in the table
+class SessionProfiler:
+    fieldnames = ["trialnum", "section", "wall", "cpu", "gc_collections", "gc_pause", "gc_longest_pause"]
+
+    def __init__(self, stats_filepath, writer):
+        self.stats_filepath = stats_filepath
+        self.writer = writer
+        self.trialnum = ""
+        self.section = None
+        self.gc_start = None
+        self.gc_collections = 0
+        self.gc_pause = 0.0
+        self.gc_longest_pause = 0.0
+        gc.callbacks.append(self.gc_callback)
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def gc_callback(self, phase, info):
+        if phase == "start":
+            self.gc_start = time.perf_counter()
+        elif self.gc_start is not None:
+            pause = time.perf_counter() - self.gc_start
+            self.gc_collections += 1
+            self.gc_pause += pause
+            self.gc_longest_pause = max(self.gc_longest_pause, pause)
+            self.gc_start = None
+
+    def start(self, section, trialnum=None):
+        self.stop()
+        if trialnum is not None:
+            self.trialnum = trialnum
+        self.section = section
+        self.gc_collections = 0
+        self.gc_pause = 0.0
+        self.gc_longest_pause = 0.0
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+
+    def stop(self):
+        if self.section is None:
+            return
+        self.writer.write({"trialnum": self.trialnum,
+                           "section": self.section,
+                           "wall": time.perf_counter() - self.wall_start,
+                           "cpu": time.process_time() - self.cpu_start,
+                           "gc_collections": self.gc_collections,
+                           "gc_pause": self.gc_pause,
+                           "gc_longest_pause": self.gc_longest_pause})
+        self.section = None
+
+    def close(self):
+        self.stop()
+        self.profile.disable()
+        self.profile.dump_stats(self.stats_filepath)
+        gc.callbacks.remove(self.gc_callback)
+        self.writer.close()
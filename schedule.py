@@ -0,0 +1,211 @@
+# Trial schedule and counterbalancing for NC1 (no PsychoPy needed)
+#   python schedule.py     compile and check every counterbalancing cell
+import itertools
+import random
+import sys
+
+#### 4 x blocks (4x fixed 12x outcomes with high/low OD)
+num_familiarisation = 10
+num_calibration = 4
+num_blocks_conditioning = 4
+num_blocks_extinction = 4
+
+conditioning_outcome_blocks = {
+    "highOD": [
+            ["low4", "high", "low3", "low5", "low3", "low5", "high", "low4", "high", "low5", "low4", "low3"],
+            ["low5", "low3", "low4", "high", "high", "low3", "low5", "low4", "low3", "high", "low4", "low5"],
+            ["low4", "low3", "low5", "high", "low5", "high", "low3", "low4", "low3", "high", "low4", "low5"],
+            ["low5", "low4", "high", "low3", "low3", "low5", "high", "low4", "high", "low3", "low4", "low5"]
+        ],
+    "lowOD": [
+            ["high", "high", "low4", "high", "high", "low3", "high", "high", "low5", "high", "high", "high"],
+            ["high", "high", "low5", "high", "low4", "high", "high", "high", "low3", "high", "high", "high"],
+            ["low3", "high", "high", "high", "high", "low5", "high", "high", "high", "low4", "high", "high"],
+            ["high", "high", "low5", "high", "high", "low3", "high", "high", "low4", "high", "high", "high"]
+        ]
+    }
+
+#low heat for every trial in extinction regardless of stimulus
+extinction_outcome_block = ['med']*12
+
+calibration_outcome_block = ['med'] * num_calibration
+
+# Group == 1 == high OD
+# Group == 2 == low OD
+# Group == 3 == NH
+# cb == 1 == RENS = GREEN, control = BLUE
+# cb == 2 == RENS = BLUE, control = GREEN
+# PID % 6 -> (group, cb, groupname)
+counterbalancing = {1: (1, 1, "highOD"),
+                    2: (2, 1, "lowOD"),
+                    3: (3, 1, "naturalhistory"),
+                    4: (1, 2, "highOD"),
+                    5: (2, 2, "lowOD"),
+                    0: (3, 2, "naturalhistory")}
+
+def assign_group(PID):
+    return counterbalancing[int(PID) % 6]
+
+def make_block_order(rng=random):
+    block_order = [1, 2, 3, 4]
+    rng.shuffle(block_order)
+    return block_order
+
+# One trial: fixed fields in slots instead of a dict, read and set like a dict (trial["phase"])
+# The slot order is the column order of the data file, session fields are added by the writer
+class Trial:
+    __slots__ = ["phase",
+                 "blocknum",
+                 "blockname",
+                 "stimulus",
+                 "outcome",
+                 "exp_response",
+                 "pain_response",
+                 "iti",
+                 # response times (s): ready_rt from the keyboard's device timestamp, the rest from mouse presses (frame resolution)
+                 "ready_rt",
+                 "ready_delay", # how much later than the press polling noticed it
+                 "choice_rt",
+                 "expectancy_touch",
+                 "pain_rt",
+                 "trialnum"]
+
+    def __init__(self, **fields): # make_trial() builds every session's trials through here
+        for field in self.__slots__:
+            value = fields.get(field)
+            setattr(self, field, sys.intern(value) if isinstance(value, str) else value) # one copy of each phase/outcome/blockname string
+
+    @classmethod
+    def from_row(cls, row): # row of values in slot order
+        return cls(**dict(zip(cls.__slots__, row)))
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        setattr(self, field, value)
+
+    def keys(self):
+        return self.__slots__
+
+    def values(self):
+        return [getattr(self, field) for field in self.__slots__]
+
+    def copy(self):
+        return Trial.from_row(self.values())
+
+def make_trial(phase, blocknum=None, blockname=None, outcome=None):
+    return Trial(phase=phase, blocknum=blocknum, blockname=blockname, outcome=outcome)
+
+# Returns the full list of trials and the conditioning block names for one participant
+def make_trial_order(groupname, cb, block_order):
+    #blockname
+    blockname = []
+    block_outcomes = []
+
+    # naturalhistory alternates between highOD and lowOD by block number
+    # cb == 1 starts with highOD, cb == 2 starts with lowOD
+    for block in range(1, num_blocks_conditioning + 1):
+        block_idx = block_order[block - 1]
+        if groupname == "naturalhistory":
+            blocktype = "highOD" if (block + cb) % 2 == 0 else "lowOD" # cb=1: blocks 1,3 are highOD; cb=2: blocks 1,3 are lowOD
+        else:
+            blocktype = groupname
+        block_outcomes.append(conditioning_outcome_blocks[blocktype][block_idx - 1])
+        blockname.append(f"{blocktype}_{block_idx}")
+
+    # familiarisation trials
+    trial_order = [make_trial("familiarisation") for i in range(num_familiarisation)]
+
+    # calibration trials
+    for outcome in calibration_outcome_block:
+        trial_order.append(make_trial("calibration", outcome = outcome))
+
+    ### create list of trials based on trial_block order, iterating through stimulus + outcome blocks in parallel
+    for block in range(1, num_blocks_conditioning + 1):
+        # Create trials for each outcome in this block
+        for outcome in block_outcomes[block - 1]:
+            trial_order.append(make_trial("conditioning", block, blockname[block - 1], outcome))
+
+    #create extinction trials, all outcomes same regardless of condition (low heat)
+    for block in range(num_blocks_conditioning + 1, num_blocks_conditioning + num_blocks_extinction + 1):
+        # All extinction trials use medium heat regardless of group
+        for outcome in extinction_outcome_block:
+            trial_order.append(make_trial("extinction", block, outcome = outcome))
+
+    # # Assign trial numbers
+    for trialnum, trial in enumerate(trial_order, start=1):
+        trial["trialnum"] = trialnum
+
+    return trial_order, blockname
+
+# One participant's trials with the offsets of each phase and block, so neither needs a scan
+class Schedule:
+    def __init__(self, groupname, cb, block_order, trials, blocknames):
+        self.groupname = groupname
+        self.cb = cb
+        self.block_order = block_order
+        self.trials = trials
+        self.blocknames = blocknames
+        self.phase_offsets = {} # phase -> (start, stop) in trials
+        self.block_offsets = {} # blocknum -> (start, stop) in trials
+        for i, trial in enumerate(trials):
+            self.phase_offsets[trial["phase"]] = (self.phase_offsets.get(trial["phase"], (i,))[0], i + 1)
+            if trial["blocknum"] is not None:
+                self.block_offsets[trial["blocknum"]] = (self.block_offsets.get(trial["blocknum"], (i,))[0], i + 1)
+
+    def phase(self, phase):
+        start, stop = self.phase_offsets.get(phase, (0, 0))
+        return self.trials[start:stop]
+
+    def blocks(self, phase): # [(blocknum, trials)] for the blocks in a phase
+        start, stop = self.phase_offsets.get(phase, (0, 0))
+        return [(blocknum, self.trials[block_start:block_stop])
+                for blocknum, (block_start, block_stop) in self.block_offsets.items()
+                if start <= block_start < stop]
+
+    def validate(self): # raises ValueError if the schedule breaks the design
+        phase_lengths = {"familiarisation": num_familiarisation,
+                         "calibration": num_calibration,
+                         "conditioning": num_blocks_conditioning * len(conditioning_outcome_blocks["highOD"][0]),
+                         "extinction": num_blocks_extinction * len(extinction_outcome_block)}
+        if list(self.phase_offsets) != list(phase_lengths):
+            raise ValueError(f"phases out of order: {list(self.phase_offsets)}")
+        for phase, length in phase_lengths.items():
+            start, stop = self.phase_offsets[phase]
+            if stop - start != length or any(trial["phase"] != phase for trial in self.trials[start:stop]):
+                raise ValueError(f"{phase} should be {length} consecutive trials")
+        if [trial["trialnum"] for trial in self.trials] != list(range(1, len(self.trials) + 1)):
+            raise ValueError("trial numbers are not consecutive")
+        if sorted(self.block_order) != [1, 2, 3, 4]:
+            raise ValueError(f"block order {self.block_order} is not a permutation of 1-4")
+
+        for blocknum, trials in self.blocks("conditioning"):
+            blocktype, block_idx = self.blocknames[blocknum - 1].rsplit("_", 1)
+            if self.groupname == "naturalhistory":
+                expected_type = "highOD" if (blocknum + self.cb) % 2 == 0 else "lowOD"
+            else:
+                expected_type = self.groupname
+            if blocktype != expected_type or int(block_idx) != self.block_order[blocknum - 1]:
+                raise ValueError(f"block {blocknum} is {self.blocknames[blocknum - 1]}, expected {expected_type}_{self.block_order[blocknum - 1]}")
+            expected = conditioning_outcome_blocks[blocktype][int(block_idx) - 1]
+            outcomes = [trial["outcome"] for trial in trials]
+            if outcomes != expected:
+                raise ValueError(f"block {blocknum} outcomes do not match {self.blocknames[blocknum - 1]}")
+        for blocknum, trials in self.blocks("extinction"):
+            if any(trial["outcome"] != "med" for trial in trials):
+                raise ValueError(f"extinction block {blocknum} has outcomes other than med")
+        return self
+
+def compile_schedule(groupname, cb, block_order):
+    trials, blocknames = make_trial_order(groupname, cb, block_order)
+    return Schedule(groupname, cb, list(block_order), trials, blocknames).validate()
+
+# Every counterbalancing cell (group x cb x block order), compiled and checked; sessions compile their own cell on demand
+def compile_all():
+    return [compile_schedule(groupname, cb, block_order)
+            for group, cb, groupname in sorted(set(counterbalancing.values()))
+            for block_order in itertools.permutations([1, 2, 3, 4])]
+
+if __name__ == "__main__":
+    print(f"Compiled and checked {len(compile_all())} schedules")
@@ -0,0 +1,158 @@
+# Monte Carlo simulation of the NC1 protocol with virtual participants (no PsychoPy needed)
+#   python simulate.py [--participants 1000000] [--model rw] [--param alpha=0.2] [--sample-size 30]
+#   python simulate.py --design design.json     try other conditioning_outcome_blocks ({"highOD": [...], "lowOD": [...]})
+# Participants are spread evenly over every group x cb x block order cell. Each cell runs its compiled
+# schedule for all of its participants at once (NumPy arrays over participants, one step per trial)
+# and the cells are shared out over a process pool.
+import argparse
+import itertools
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import schedule
+
+# Placeholder mean pain ratings (0-100) for each outcome, set these from calibration or pilot data
+outcome_pain = {"high": 80.0, "med": 50.0, "low5": 40.0, "low4": 30.0, "low3": 20.0}
+rating_sd = 10.0
+# None follows NC1.py, which delivers the scheduled outcome whatever the choice. Set an outcome (e.g. "med",
+# or --control-outcome med) to try a design where only RENS trials get the scheduled outcome
+control_outcome = None
+
+### Choice/learning models, vectorised over participants:
+### start(n, rng) sets up n participants, then on every trial choose(rng) -> bool array (True = RENS),
+### expectancy(choice) -> expected pain for the chosen option and learn(choice, pain)
+class RandomChoice:
+    def __init__(self, p_RENS=0.5):
+        self.p_RENS = p_RENS
+
+    def start(self, n, rng):
+        self.n = n
+
+    def choose(self, rng):
+        return rng.random(self.n) < self.p_RENS
+
+    def expectancy(self, choice):
+        return np.full(self.n, np.nan)
+
+    def learn(self, choice, pain):
+        pass
+
+# Rescorla-Wagner expected pain for control and RENS, softmax choice of the option expected to hurt less
+# Learning rates vary between participants (normal, clipped to 0.01-1). initial_RENS is the prior for RENS,
+# below initial because the instructions tell participants RENS reduces pain (placeholder, e.g. --param initial_RENS=50)
+class RescorlaWagner:
+    def __init__(self, alpha=0.3, alpha_sd=0.1, beta=0.1, initial=50.0, initial_RENS=30.0):
+        self.alpha_mean = alpha
+        self.alpha_sd = alpha_sd
+        self.beta = beta
+        self.initial = initial
+        self.initial_RENS = initial_RENS
+
+    def start(self, n, rng):
+        self.rows = np.arange(n)
+        self.alpha = np.clip(rng.normal(self.alpha_mean, self.alpha_sd, n), 0.01, 1)
+        self.values = np.full((n, 2), self.initial) # column 0 control, 1 RENS
+        self.values[:, 1] = self.initial_RENS
+
+    def choose(self, rng):
+        p_RENS = 1 / (1 + np.exp(-self.beta * (self.values[:, 0] - self.values[:, 1])))
+        return rng.random(len(self.rows)) < p_RENS
+
+    def expectancy(self, choice):
+        return self.values[self.rows, choice.astype(int)]
+
+    def learn(self, choice, pain):
+        chosen = choice.astype(int)
+        self.values[self.rows, chosen] += self.alpha * (pain - self.values[self.rows, chosen])
+
+models = {"random": RandomChoice, "rw": RescorlaWagner}
+
+def use_design(design): # runs in every worker process
+    if design:
+        schedule.conditioning_outcome_blocks = design
+
+# Runs in a worker process: one cell -> per participant RENS rate and mean expectancy for each block
+def simulate_cell(model_name, model_args, groupname, cb, block_order, n, seed, phases, control_outcome):
+    trials = [trial for phase in phases for trial in schedule.compile_schedule(groupname, cb, block_order).phase(phase)]
+    blocks = sorted({trial["blocknum"] for trial in trials})
+    rng = np.random.default_rng(seed)
+    model = models[model_name](**model_args)
+    model.start(n, rng)
+
+    RENS = np.zeros((n, len(blocks)))
+    expectancy = np.zeros((n, len(blocks)))
+    block_trials = np.zeros(len(blocks))
+    for trial in trials:
+        block = blocks.index(trial["blocknum"])
+        choice = model.choose(rng)
+        expectancy[:, block] += model.expectancy(choice)
+        mean_pain = np.where(choice, outcome_pain[trial["outcome"]], outcome_pain[control_outcome or trial["outcome"]])
+        model.learn(choice, np.clip(rng.normal(mean_pain, rating_sd), 0, 100))
+        RENS[:, block] += choice
+        block_trials[block] += 1
+    return groupname, blocks, (RENS / block_trials).astype(np.float32), (expectancy / block_trials).astype(np.float32)
+
+# Share of simulated studies (sample_size per group) where the RENS rates of two groups differ at p < .05
+# (Welch t compared with 1.96, close enough for samples of 20 or more)
+def power(rates_a, rates_b, sample_size, rng):
+    studies = min(len(rates_a), len(rates_b)) // sample_size
+    if studies == 0:
+        return np.nan, 0
+    a = rng.permutation(rates_a)[:studies * sample_size].reshape(studies, sample_size)
+    b = rng.permutation(rates_b)[:studies * sample_size].reshape(studies, sample_size)
+    se = np.sqrt(a.var(axis=1, ddof=1) / sample_size + b.var(axis=1, ddof=1) / sample_size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = (a.mean(axis=1) - b.mean(axis=1)) / se
+    return np.mean(np.abs(t) > 1.96), studies
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--participants", type=int, default=100000, help="virtual participants in total")
+    parser.add_argument("--model", choices=models, default="rw")
+    parser.add_argument("--param", action="append", default=[], help="model parameter, e.g. --param alpha=0.2")
+    parser.add_argument("--phases", nargs="+", choices=["conditioning", "extinction"], default=["conditioning"], help="phases with a RENS choice to simulate")
+    parser.add_argument("--control-outcome", choices=outcome_pain, default=control_outcome, help="outcome on control trials (default: the scheduled outcome, as in NC1.py)")
+    parser.add_argument("--sample-size", type=int, default=30, help="participants per group in each simulated study")
+    parser.add_argument("--design", help="JSON file with conditioning_outcome_blocks to use instead of schedule.py")
+    parser.add_argument("--workers", type=int, help="number of processes (default: one per core)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    model_args = {name: float(value) for name, value in (param.split("=", 1) for param in args.param)}
+    design = None
+    if args.design:
+        with open(args.design) as design_file:
+            design = json.load(design_file)
+
+    cells = [(groupname, cb, list(block_order))
+             for group, cb, groupname in sorted(set(schedule.counterbalancing.values()))
+             for block_order in itertools.permutations([1, 2, 3, 4])]
+    sizes = [len(part) for part in np.array_split(np.arange(args.participants), len(cells))]
+    seeds = np.random.SeedSequence(args.seed).spawn(len(cells) + 1)
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=use_design, initargs=(design,)) as executor:
+        results = list(executor.map(simulate_cell, itertools.repeat(args.model), itertools.repeat(model_args),
+                                    *zip(*cells), sizes, seeds[:-1], itertools.repeat(args.phases),
+                                    itertools.repeat(args.control_outcome)))
+
+    groups = {}
+    for groupname, blocks, RENS, expectancy in results:
+        groups.setdefault(groupname, []).append((RENS, expectancy))
+    groups = {groupname: (np.concatenate([RENS for RENS, _ in parts]), np.concatenate([expectancy for _, expectancy in parts]))
+              for groupname, parts in groups.items()}
+
+    print(f"{args.participants} participants, model {args.model}{' ' + str(model_args) if model_args else ''}, phases {', '.join(args.phases)}"
+          f", control trials get {args.control_outcome or 'the scheduled outcome'}")
+    print(f"{'group':<16}{'block':>6}{'RENS':>8}{'exp':>8}")
+    for groupname, (RENS, expectancy) in groups.items():
+        for block, blocknum in enumerate(results[0][1]):
+            print(f"{groupname:<16}{blocknum:>6}{RENS[:, block].mean():>8.3f}{expectancy[:, block].mean():>8.1f}")
+
+    rng = np.random.default_rng(seeds[-1])
+    print(f"Power to detect a difference in RENS rate with {args.sample_size} per group:")
+    for group_a, group_b in itertools.combinations(groups, 2):
+        rates_a, rates_b = groups[group_a][0].mean(axis=1), groups[group_b][0].mean(axis=1)
+        group_power, studies = power(rates_a, rates_b, args.sample_size, rng)
+        print(f"  {group_a} vs {group_b}: difference {rates_a.mean() - rates_b.mean():+.3f}, power {group_power:.3f} ({studies} studies)")
@@ -0,0 +1,129 @@
+# Optional SQLite store for every session in the lab, next to the per-participant CSV files
+#   python NC1.py --database data/NC1.sqlite      also save each finished trial to the database
+#   python store.py DATABASE FOLDER               export every session as <PID>_responses.csv
+# Example query (mean pain on high-outcome RENS trials by group):
+#   SELECT groupname, AVG(pain_response) FROM trials JOIN sessions USING (session_id)
+#   WHERE outcome = 'high' AND stimulus = 'RENS' GROUP BY groupname
+import csv
+import os
+import sqlite3
+
+from data import WriterThread
+from schedule import Trial
+
+# column order of the <PID>_responses.csv files
+trial_fields = list(Trial.__slots__)
+session_fields = ["datetime", "experimentcode", "PID", "SONA", "group", "groupname", "cb", "blockorder"]
+
+schema = """
+CREATE TABLE IF NOT EXISTS participants (
+    PID TEXT PRIMARY KEY,
+    SONA TEXT);
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id INTEGER PRIMARY KEY,
+    PID TEXT REFERENCES participants (PID),
+    datetime TEXT,
+    experimentcode TEXT,
+    grp INTEGER,
+    groupname TEXT,
+    cb INTEGER,
+    blockorder TEXT);
+CREATE TABLE IF NOT EXISTS trials (
+    session_id INTEGER REFERENCES sessions (session_id),
+    trialnum INTEGER,
+    phase TEXT,
+    blocknum INTEGER,
+    blockname TEXT,
+    stimulus TEXT,
+    outcome TEXT,
+    exp_response REAL,
+    pain_response REAL,
+    iti REAL,
+    ready_rt REAL,
+    ready_delay REAL,
+    choice_rt REAL,
+    expectancy_touch REAL,
+    pain_rt REAL,
+    PRIMARY KEY (session_id, trialnum));
+CREATE INDEX IF NOT EXISTS sessions_PID ON sessions (PID);
+CREATE INDEX IF NOT EXISTS trials_phase_blocknum ON trials (phase, blocknum);
+CREATE INDEX IF NOT EXISTS trials_outcome ON trials (outcome);
+"""
+
+def connect(database, timeout=10):
+    db = sqlite3.connect(database, timeout=timeout)
+    db.execute("PRAGMA journal_mode = WAL") # other booths and analyses can read while a session writes
+    db.executescript(schema)
+    columns = [row[1] for row in db.execute("PRAGMA table_info(trials)")]
+    for field in trial_fields: # databases made before a column was added
+        if field not in columns:
+            db.execute(f"ALTER TABLE trials ADD COLUMN {field}")
+    return db
+
+# Inserts finished trials from a background thread, same interface as data.DataWriter
+class SessionStore(WriterThread):
+    def __init__(self, database, session_info, fsync=True):
+        self.database = database
+        self.session_info = session_info
+        self.fsync = fsync
+        self.session_id = None
+        self.start_thread(database)
+
+    def write(self, trial):
+        self.check()
+        self.queue.put(trial)
+
+    def run(self):
+        db = connect(self.database)
+        db.execute(f"PRAGMA synchronous = {'FULL' if self.fsync else 'NORMAL'}")
+        info = self.session_info
+        with db:
+            db.execute("INSERT OR IGNORE INTO participants VALUES (?, ?)", (info["PID"], info["SONA"]))
+            self.session_id = db.execute("INSERT INTO sessions VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)",
+                                         (info["PID"], info["datetime"], info["experimentcode"], info["group"],
+                                          info["groupname"], info["cb"], str(info["blockorder"]))).lastrowid
+        self.opened.set()
+
+        finished = False
+        while not finished:
+            trials = [self.queue.get()]
+            while not self.queue.empty(): # commit any backlog in one transaction
+                trials.append(self.queue.get())
+            if None in trials:
+                finished = True
+                trials = trials[:trials.index(None)]
+            with db:
+                db.executemany(f"INSERT INTO trials (session_id, {', '.join(trial_fields)}) VALUES (?{', ?' * len(trial_fields)})",
+                               [(self.session_id, *[trial[field] for field in trial_fields]) for trial in trials])
+        db.close()
+
+# Writes each session back out in the same layout NC1.py uses for <PID>_responses.csv
+def export_csv(database, folder):
+    db = connect(database)
+    db.row_factory = sqlite3.Row
+    os.makedirs(folder, exist_ok=True)
+    sessions = db.execute("""SELECT session_id, datetime, experimentcode, sessions.PID, SONA, grp AS "group",
+                                    groupname, cb, blockorder
+                             FROM sessions JOIN participants USING (PID) ORDER BY session_id""").fetchall()
+    filepaths = []
+    for session in sessions:
+        filepath = os.path.join(folder, f"{session['PID']}_responses.csv")
+        if filepath in filepaths: # the same PID run more than once
+            filepath = os.path.join(folder, f"{session['PID']}_{session['session_id']}_responses.csv")
+        filepaths.append(filepath)
+        trials = db.execute("SELECT * FROM trials WHERE session_id = ? ORDER BY trialnum", (session["session_id"],))
+        with open(filepath, mode="w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=trial_fields + session_fields, extrasaction="ignore")
+            writer.writeheader()
+            for trial in trials:
+                writer.writerow({**dict(trial), **{field: session[field] for field in session_fields}})
+    db.close()
+    return filepaths
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3:
+        raise SystemExit("usage: python store.py DATABASE FOLDER")
+    filepaths = export_csv(sys.argv[1], sys.argv[2])
+    print(f"Exported {len(filepaths)} sessions to {sys.argv[2]}")
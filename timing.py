@@ -0,0 +1,166 @@
+# Time source and frame timing for NC1 (PsychoPy is only imported when a RealClock is made)
+import array
+import gc
+import math
+import os
+import threading
+import time
+
+# time source for waits and trial timing, headless runs swap in headless.VirtualClock
+class RealClock:
+    def __init__(self, poll_interval=0.002):
+        from psychopy import core
+        self.core = core
+        self.poll_interval = poll_interval
+
+    def getTime(self):
+        return self.core.getTime()
+
+    def CountdownTimer(self, duration):
+        return self.core.CountdownTimer(duration)
+
+    def Timer(self, interval, function, args=()):
+        return threading.Timer(interval, function, args)
+
+    def idle(self, timeout=None): # sleep until the next poll instead of spinning a core
+        time.sleep(self.poll_interval if timeout is None else max(0, min(self.poll_interval, timeout)))
+
+# Frame-by-frame plan of the trial countdown, worked out once from the measured refresh rate
+# phases: [(phase, seconds), ...] -> {phase: [digit to show on each frame of that phase]}
+def make_countdown_frames(frame_rate, phases):
+    total_seconds = sum(seconds for _, seconds in phases)
+    total_frames = sum(round(seconds * frame_rate) for _, seconds in phases)
+    frames = {}
+    frame = 0
+    for phase, seconds in phases:
+        frames[phase] = []
+        for _ in range(round(seconds * frame_rate)):
+            seconds_left = (total_frames - frame) * total_seconds / total_frames # digits stay 10 to 1 when the rate is not a whole number
+            frames[phase].append(str(math.ceil(round(seconds_left, 6)))) # round off float error at whole seconds
+            frame += 1
+    return frames
+
+# Records the interval between consecutive flips, tagged with the trial phase they belong to
+class FrameTimer:
+    phases = ["countdown", "expectancy", "heat", "pain_rating"]
+
+    def __init__(self, frame_period, capacity=4096):
+        self.frame_period = frame_period
+        self.intervals = array.array("d", bytes(8 * capacity)) # preallocated, reused every trial
+        self.phase_codes = array.array("b", bytes(capacity))
+        self.n = 0
+        self.phase = None # flips outside a phase are not recorded
+        self.last_flip = None
+
+    def start(self, phase): # consecutive phases share the flip boundary, so no frame is lost between them
+        self.phase = self.phases.index(phase)
+
+    def stop(self):
+        self.phase = None
+        self.last_flip = None
+
+    def record(self, flip_time):
+        if self.phase is None:
+            return
+        if self.last_flip is not None:
+            if self.n == len(self.intervals): # only for very long rating periods
+                self.intervals.extend(self.intervals)
+                self.phase_codes.extend(self.phase_codes)
+            self.intervals[self.n] = flip_time - self.last_flip
+            self.phase_codes[self.n] = self.phase
+            self.n += 1
+        self.last_flip = flip_time
+
+    def summarise(self, trialnum): # one row per phase, then clear for the next trial
+        rows = []
+        for code, phase in enumerate(self.phases):
+            intervals = [self.intervals[i] for i in range(self.n) if self.phase_codes[i] == code]
+            if not intervals:
+                continue
+            rows.append({"trialnum": trialnum,
+                         "phase": phase,
+                         "frames": len(intervals),
+                         "mean_interval": sum(intervals) / len(intervals),
+                         "max_interval": max(intervals),
+                         "dropped_frames": sum(1 for x in intervals if x > 1.5 * self.frame_period)})
+        self.stop()
+        self.n = 0
+        return rows
+
+# Keeps the garbage collector, CPU migration and other processes out of a timing-critical window
+# cpu pins the process to that core, nice raises its priority (negative values need root or CAP_SYS_NICE)
+# Affinity and priority are Linux only and skipped elsewhere or when not permitted
+class CriticalSection:
+    def __init__(self, cpu=None, nice=None):
+        self.cpu = cpu
+        self.nice = nice
+        self.active = False
+        self.saved_affinity = None
+        self.saved_nice = None
+
+    def enter(self):
+        if self.active:
+            return
+        self.active = True
+        gc.freeze() # objects made so far are left alone by later collections
+        gc.disable()
+        if self.cpu is not None and hasattr(os, "sched_setaffinity"):
+            try:
+                self.saved_affinity = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, {self.cpu})
+            except OSError as error:
+                print(f"Could not pin to CPU {self.cpu}: {error}")
+                self.cpu = None
+        if self.nice is not None and hasattr(os, "setpriority"):
+            try:
+                self.saved_nice = os.getpriority(os.PRIO_PROCESS, 0)
+                os.setpriority(os.PRIO_PROCESS, 0, self.nice)
+            except OSError as error:
+                print(f"Could not set priority {self.nice}: {error}")
+                self.nice = None
+
+    def exit(self):
+        if not self.active:
+            return
+        self.active = False
+        if self.saved_nice is not None:
+            try:
+                os.setpriority(os.PRIO_PROCESS, 0, self.saved_nice) # lowering priority again is always allowed
+            except OSError:
+                pass
+            self.saved_nice = None
+        if self.saved_affinity is not None:
+            os.sched_setaffinity(0, self.saved_affinity)
+            self.saved_affinity = None
+        gc.unfreeze()
+        gc.enable()
+
+    def collect(self): # catch up on garbage skipped during the window, call it where a pause does no harm
+        if not self.active:
+            gc.collect()
+
+# Response time of the last left press since start(), measured from the flip that showed the screen
+# PsychoPy stamps a mouse press when the window dispatches its events, so these times have frame resolution
+class ResponseTimer:
+    def __init__(self, clock, mouse):
+        self.clock = clock
+        self.mouse = mouse
+        self.onset = None
+        self.rt = None
+
+    def start(self): # before the first flip of the stimulus
+        self.mouse.clickReset()
+        self.reset_time = self.clock.getTime()
+        self.onset = None
+        self.rt = None
+
+    def shown(self, flip_time): # call with every flip, the first one is the onset
+        if self.onset is None:
+            self.onset = flip_time
+        return flip_time
+
+    def stop(self): # once the response has been noticed
+        pressed, times = self.mouse.getPressed(getTime=True)
+        if times[0] > 0:
+            self.rt = self.reset_time + times[0] - self.onset
+        return self.rt
@@ -0,0 +1,68 @@
+# Per-frame slider marker and mouse samples, saved as fixed-size binary records (no PsychoPy needed)
+# Read a session back with numpy.memmap("<PID>_trajectories.bin", dtype=trajectory.record_dtype, mode="r")
+# and slice it with the start/stop offsets for each trialnum in <PID>_trajectories.csv
+import array
+
+import numpy as np
+
+phases = ["expectancy", "heat", "pain_rating"]
+record_dtype = np.dtype([("trialnum", "<i4"),
+                         ("phase", "u1"),
+                         ("pressed", "u1"),
+                         ("time", "<f8"),
+                         ("marker", "<f4"), # nan until the slider has been clicked
+                         ("mouse_x", "<f4"),
+                         ("mouse_y", "<f4")])
+
+# Samples go into preallocated columns; when they fill up they are handed to the writer and reused
+class TrajectoryRecorder:
+    def __init__(self, writer, index_writer, capacity=4096):
+        self.writer = writer
+        self.index_writer = index_writer
+        self.capacity = capacity
+        self.phase = array.array("B", bytes(capacity))
+        self.pressed = array.array("B", bytes(capacity))
+        self.time = array.array("d", bytes(8 * capacity))
+        self.marker = array.array("f", bytes(4 * capacity))
+        self.mouse_x = array.array("f", bytes(4 * capacity))
+        self.mouse_y = array.array("f", bytes(4 * capacity))
+        self.phase_codes = {phase: code for code, phase in enumerate(phases)}
+        self.n = 0
+        self.trialnum = 0
+        self.written = 0 # records handed to the writer so far
+        self.trial_start = 0
+
+    def start_trial(self, trialnum):
+        self.trialnum = trialnum
+        self.trial_start = self.written + self.n
+
+    def sample(self, phase, sample_time, marker, mouse_x, mouse_y, pressed):
+        i = self.n
+        self.phase[i] = self.phase_codes[phase]
+        self.pressed[i] = pressed
+        self.time[i] = sample_time
+        self.marker[i] = np.nan if marker is None else marker
+        self.mouse_x[i] = mouse_x
+        self.mouse_y[i] = mouse_y
+        self.n = i + 1
+        if self.n == self.capacity:
+            self.flush()
+
+    def flush(self):
+        if not self.n:
+            return
+        records = np.empty(self.n, dtype=record_dtype)
+        records["trialnum"] = self.trialnum
+        for name in ["phase", "pressed", "time", "marker", "mouse_x", "mouse_y"]:
+            records[name] = np.frombuffer(getattr(self, name), dtype=records.dtype[name].newbyteorder("="), count=self.n)
+        self.writer.write(records.tobytes())
+        self.written += self.n
+        self.n = 0
+
+    def end_trial(self): # called between trials, off the render loop
+        self.flush()
+        self.index_writer.write({"trialnum": self.trialnum, "start": self.trial_start, "stop": self.written})
+
+    def close(self): # blocks until both files are on disk
+        self.writer.close()
+        self.index_writer.close()
@@ -0,0 +1,86 @@
+# Parallel port triggers for NC1 (no PsychoPy needed, the real port is passed in)
+import threading
+
+# In-memory stand-in for parallel.ParallelPort when the ports aren't plugged in
+class SimulatedPort:
+    def __init__(self):
+        self.data = 0
+        self.writes = 0
+
+    def setData(self, data):
+        self.data = data
+        self.writes += 1
+
+    def readData(self):
+        return self.data
+
+# Only writes to the port when the byte changes and timestamps every edge
+class TriggerPort:
+    def __init__(self, port, clock):
+        self.port = port
+        self.clock = clock
+        self.value = None
+        self.edges = [] # [time, old value, new value, pulse width, flip latency] for each change
+        self.unflipped = [] # edges set before a flip and still waiting for it (timer resets have no screen of their own)
+        self.latencies = [] # (new value, flip latency) for the whole session
+        self.lock = threading.Lock() # pulses are reset from a timer thread
+        self.pulse_id = 0
+        self.pulse_start = None
+
+    def write(self, value, pulse_width=None): # caller holds the lock
+        if value == self.value:
+            return False
+        self.port.setData(value)
+        if self.value is not None: # the first write just initialises the port
+            edge = [self.clock.getTime(), self.value, value, pulse_width, None]
+            self.edges.append(edge)
+            if pulse_width is None:
+                self.unflipped.append(edge)
+        self.value = value
+        return True
+
+    def set(self, value):
+        with self.lock:
+            self.pulse_id += 1 # cancels any pending pulse reset
+            return self.write(value)
+
+    def pulse(self, value, duration): # raise the pins and return straight away, a timer thread resets them
+        with self.lock:
+            self.pulse_id += 1
+            self.write(value)
+            self.pulse_start = self.clock.getTime()
+            self.clock.Timer(duration, self.end_pulse, args=[self.pulse_id]).start()
+
+    def end_pulse(self, pulse_id):
+        with self.lock:
+            if pulse_id == self.pulse_id:
+                self.write(0, pulse_width = self.clock.getTime() - self.pulse_start)
+
+    def flipped(self, flip_time): # pair new edges with the flip that put the matching screen up
+        if not self.unflipped:
+            return
+        with self.lock:
+            for edge in self.unflipped:
+                edge[4] = flip_time - edge[0]
+                self.latencies.append((edge[2], edge[4]))
+            self.unflipped = []
+
+    def latency_summary(self): # {value: (edges, mean, SD (jitter), max)} over the session
+        summary = {}
+        for value in sorted(set(value for value, latency in self.latencies)):
+            latencies = [latency for edge_value, latency in self.latencies if edge_value == value]
+            mean = sum(latencies) / len(latencies)
+            sd = (sum((latency - mean) ** 2 for latency in latencies) / len(latencies)) ** 0.5
+            summary[value] = (len(latencies), mean, sd, max(latencies))
+        return summary
+
+    def pop_edges(self): # rising/falling pins for each change since the last call
+        with self.lock:
+            edges, self.edges = self.edges, []
+            self.unflipped = []
+        return [{"time": edge_time,
+                 "value": new,
+                 "rising": new & ~old,
+                 "falling": old & ~new,
+                 "pulse_width": pulse_width,
+                 "flip_latency": flip_latency} for edge_time, old, new, pulse_width, flip_latency in edges]